@@ -11,15 +11,15 @@ router = APIRouter(tags=["API Usage"])
 @log_print
 def upload_api_usage():
     """
-    將本地 API 使用次數與 Firebase 歷史資料合併後上傳。
+    立即將本地 API 使用次數增量上傳至 Firebase（平時由背景定期上傳）。
     """
     try:
         data = api_usage_counter.upload_usage()
         return {
             "status": "success",
             "localUploaded": data["local_uploaded"],
-            "mergedDates": data["merged_dates"],
-            "mergedUsage": data["merged_usage"],
+            "uploadedDates": data["uploaded_dates"],
+            "breakdown": data["breakdown"],     # 各日期本次上傳的各端點、各 type 次數
             "updateTime": TaiwanTime.string(),
         }
     except Exception as e:
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
 
 from services.feedback import FeedbackService
 from util.logger import log_print
@@ -22,9 +23,9 @@ class FeedbackResponse(BaseModel):
 
 @router.post("/feedback", response_model=FeedbackResponse)
 @log_print
-def create_feedback(feedback: FeedbackRequest):
+async def create_feedback(feedback: FeedbackRequest):
     """
-    接收使用者意見回饋並存入 Firebase
+    接收使用者意見回饋，寫入本地佇列後立即回應（背景整批存入 Firebase）
     
     參數:
     - type: 回饋類型 (suggestion/bug/data/other)
@@ -49,7 +50,8 @@ def create_feedback(feedback: FeedbackRequest):
             )
         
         # 呼叫服務層處理
-        feedback_id = FeedbackService.create_feedback(
+        feedback_id = await asyncio.to_thread(
+            FeedbackService.create_feedback,
             feedback_type=feedback.type,
             name=feedback.name,
             email=feedback.email,
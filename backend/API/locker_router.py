@@ -1,87 +1,184 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, Header, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-import time
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+import asyncio
+import logging
 
-from services.locker import *
+from services.locker_cache import locker_cache
+from services.locker_snapshot import format_changes, ALL_VIEW
+from services.locker_stream import locker_broadcaster, format_sse
 from services.api_usage import api_usage_counter
-from util.logger import log_print, Log, Color
-from util.config import KRTC_STATION_TAGS, StationGPSManager
+from util.logger import log_print, logger, Log, Color
+from util.config import StationGPSManager
 from util.nowtime import TaiwanTime
+from util.metrics import LOCKER_REQUESTS
 
 router = APIRouter(tags=["LockerMaps Data"])
 
-# 全域快取
-cache_data = {}
-last_fetch_time = 0
-CACHE_TTL = 30  # 單位：秒
-cache_lock = threading.Lock()  # 防止 race condition
+NEAR_DEFAULT_K = 10     # near 未指定 radius 與 k 時回傳的筆數
+NOT_READY_RETRY_AFTER = 2   # 第一份快照建立前，請客戶端幾秒後重試
+
+def require_snapshot():
+    """
+    取得目前快照；尚未建立第一份快照時回傳 503（不帶 ETag，避免客戶端快取空資料）
+    """
+    if not locker_cache.is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="置物櫃資料載入中，請稍後再試",
+            headers={"Retry-After": str(NOT_READY_RETRY_AFTER)},
+        )
+    return locker_cache.snapshot()
+
+def parse_floats(value: str, count: int, name: str) -> tuple:
+    """解析以逗號分隔的座標參數"""
+    try:
+        numbers = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        numbers = ()
+    if len(numbers) != count:
+        raise HTTPException(status_code=400, detail=f"{name} 格式錯誤")
+    return numbers
 
 @router.get("/Locker")
 @log_print
-def get_LockerData(type: str = Query(None, description="Locker type: MRT, TRA, OWL, KRTC")):
-    global cache_data, last_fetch_time
+def get_LockerData(
+    type: str = Query(None, description="Locker type: MRT, TRA, OWL, KRTC"),
+    bbox: str = Query(None, description="範圍：minLng,minLat,maxLng,maxLat"),
+    near: str = Query(None, description="中心點：lat,lng（結果依距離排序）"),
+    radius: float = Query(None, gt=0, description="near 的搜尋半徑（公尺）"),
+    k: int = Query(None, ge=1, le=200, description="near 的最多回傳筆數"),
+    size: str = Query(None, pattern="^[SML]$", description="櫃位尺寸：S, M, L"),
+    min_empty: int = Query(None, ge=0, description="最少空櫃數"),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     try:
-        api_usage_counter.increment()
-        now = time.time()
-        
-        # 超過 TTL 才重新爬
-        if now - last_fetch_time > CACHE_TTL or not cache_data:
-            with cache_lock:  # 使用鎖保護
-                # 雙重檢查：進入鎖後再次確認是否需要更新
-                if now - last_fetch_time > CACHE_TTL or not cache_data:
-                    # 並行執行所有爬蟲
-                    with ThreadPoolExecutor(max_workers=6) as executor:
-                        futures = {
-                            executor.submit(getMRTLockerData): "MRT",
-                            executor.submit(getTRALockerData): "TRA",
-                            executor.submit(getOWLockerData): "OWL",
-                            executor.submit(getArenaLockerData): "Arena",
-                            executor.submit(getTcapLockerData): "Tcap",
-                            executor.submit(getKRTCLockerData): "KRTC"
-                        }
-                        
-                        temp_cache = {}
-                        for future in as_completed(futures):
-                            key = futures[future]
-                            try:
-                                temp_cache[key] = future.result()
-                            except Exception as e:
-                                Log(f"爬取 {key} 失敗: {e}", color=Color.RED)
-                                temp_cache[key] = []
-                        
-                        cache_data = temp_cache
-                    last_fetch_time = time.time()  # 使用最新時間
-
-        # 根據參數篩選
-        if type in cache_data:
-            data = cache_data[type]
-        else:
-            data = sum(cache_data.values(), []) # 合併所有類型
-            for station in data:
-                name = station["station"]
-                stationData = StationGPSManager.get_station_GPS_dict()
-                if name == "台北車站" and station["type"] == "TRA":
-                    station.update({ "lat": 25.047784479915663, "lng": 121.51642612598873 })
-                    continue
-                if name in stationData:
-                    station.update({
-                        "lat": stationData[name]["lat"],
-                        "lng": stationData[name]["lng"]
-                    })
-                else:
-                    fetchData = StationGPSManager.get_or_create_gps(name)
-                    station.update({
-                        "lat": fetchData["lat"] if fetchData else 0,
-                        "lng": fetchData["lng"] if fetchData else 0
-                    })
-        Log("資料更新時間：" ,datetime.fromtimestamp(last_fetch_time).strftime("%Y-%m-%d %H:%M:%S"), color=Color.GREEN, reload_only=True)
-        return data
+        # 快照由背景任務更新並預先序列化，這裡只讀取記憶體
+        snapshot = require_snapshot()
+        # 只記錄存在的來源，避免任意 type 值造成統計欄位無限增加
+        api_usage_counter.increment("/Locker", type if type in snapshot.data else ALL_VIEW)
+
+        # 有篩選條件時由空間索引查詢
+        if any(param is not None for param in (bbox, near, size, min_empty)):
+            box = None
+            if bbox is not None:
+                min_lng, min_lat, max_lng, max_lat = parse_floats(bbox, 4, "bbox")
+                box = (min_lat, min_lng, max_lat, max_lng)
+            center = parse_floats(near, 2, "near") if near is not None else None
+            if center is not None and radius is None and k is None:
+                k = NEAR_DEFAULT_K
+            data = snapshot.search(type=type, bbox=box, near=center, radius=radius, k=k, size=size, min_empty=min_empty)
+            LOCKER_REQUESTS.labels("computed").inc()
+            return JSONResponse(content=data, headers={
+                "Last-Modified": snapshot.last_modified,
+                "Cache-Control": "no-cache",
+                "X-Snapshot-Age": str(int(locker_cache.age())),
+            })
+
+        view = snapshot.view(type)
+
+        headers = {
+            "ETag": view.etag,
+            "Last-Modified": snapshot.last_modified,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+            "X-Snapshot-Version": str(snapshot.version),
+            "X-Snapshot-Age": str(int(locker_cache.age())),   # 距最後一次成功爬取多久（秒），剛重新啟動時可能是上次保存的資料
+        }
+        if logger.isEnabledFor(logging.DEBUG):     # 只在輸出開發用訊息時才格式化時間
+            Log("資料更新時間：" ,datetime.fromtimestamp(snapshot.fetch_time).strftime("%Y-%m-%d %H:%M:%S"), color=Color.GREEN, reload_only=True)
+
+        # 客戶端已有最新資料
+        if view.matches(if_none_match):
+            LOCKER_REQUESTS.labels("not_modified").inc()
+            return Response(status_code=304, headers=headers)
+        LOCKER_REQUESTS.labels("prerendered").inc()
+
+        content, encoding = view.negotiate(accept_encoding)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=content, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
 
+@router.get("/Locker/changes")
+@log_print
+def get_LockerChanges(since: int = Query(..., ge=0, description="上次取得的快照版本（X-Snapshot-Version）")):
+    """
+    取得指定版本之後有變動的櫃位。
+    版本過舊（超出保留範圍）時回傳完整資料（full=true）。
+    """
+    try:
+        snapshot = require_snapshot()
+        api_usage_counter.increment("/Locker/changes")
+        changes = locker_cache.changes_since(since)
+
+        # 無法比對時回傳完整快照，直接沿用預先序列化的內容
+        if changes is None:
+            body = b'{"version":%d,"full":true,"data":%s}' % (snapshot.version, snapshot.view().body)
+            return Response(content=body, media_type="application/json")
+
+        changed, removed = format_changes(changes)
+        return JSONResponse(content={
+            "version": snapshot.version,
+            "full": False,
+            "changes": changed,
+            "removed": removed,
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        return HTTPException(status_code=500, detail=str(e))
+
+STREAM_HEARTBEAT = 15  # 推播連線的心跳間隔（秒）
+
+@router.get("/Locker/stream")
+@log_print
+async def stream_LockerChanges(last_event_id: Optional[int] = Header(None)):
+    """
+    以 Server-Sent Events 推播置物櫃更新。
+
+    - changes：新的快照版本與有變動的櫃位（格式同 /Locker/changes）
+    - resync：客戶端落後太多，請以 /Locker/changes?since= 重新同步
+    斷線重連時瀏覽器會帶上 Last-Event-ID，先補送該版本之後的差異。
+    """
+    api_usage_counter.increment("/Locker/stream")
+    if locker_broadcaster.is_full():
+        raise HTTPException(status_code=503, detail="推播連線數已達上限")
+
+    async def event_generator():
+        # 在產生器內訂閱：客戶端在開始讀取前就斷線時不會留下訂閱
+        queue = locker_broadcaster.subscribe()
+        if queue is None:   # 檢查後到開始推播之間連線數已滿
+            return
+        try:
+            snapshot = locker_cache.snapshot()
+            changes = locker_cache.changes_since(last_event_id) if last_event_id is not None else {}
+            if changes is None:
+                yield format_sse("resync", {"version": snapshot.version}, id=snapshot.version)
+            else:
+                changed, removed = format_changes(changes)
+                yield format_sse("changes", {"version": snapshot.version, "changes": changed, "removed": removed}, id=snapshot.version)
+
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+        finally:
+            locker_broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/ReloadStationGPS")
 @log_print
 def reload_station_gps():
@@ -95,6 +192,17 @@ def reload_station_gps():
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
 
+@router.get("/StationGPSStats")
+@log_print
+def get_station_gps_stats():
+    """
+    取得站點座標查詢統計（地理編碼次數、失敗快取命中率與大小）。
+    """
+    try:
+        return {**StationGPSManager.stats(), "updateTime": TaiwanTime.string()}
+    except Exception as e:
+        return HTTPException(status_code=500, detail=str(e))
+
 class StationGPSUpdate(BaseModel):
     station: str
     lat: float
@@ -1,11 +1,19 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.openapi.utils import get_openapi
+from contextlib import asynccontextmanager
+import asyncio
 import secrets
 
 from API import locker_router, feedback_router, api_usage_router
+from services.locker_cache import locker_cache
+from services.api_usage import api_usage_counter
+from services.feedback_queue import feedback_queue
+from util.config import StationGPSManager
+from util.http_client import HttpClient
+from util.metrics import MetricsMiddleware, render as render_metrics
 
 from util.env import Env
 
@@ -28,8 +36,28 @@ def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials
 
+async def start_station_gps():
+    """初始化 Firebase 並同步站點座標（在執行緒中進行），完成後以新座標重新組成快照"""
+    await asyncio.to_thread(StationGPSManager.start)
+    await locker_cache.refresh_gps()
+
+# 應用程式生命週期：並行啟動背景任務，不等待 Firebase 與第一次爬取（就緒狀態見 /ready）
+# 停止時上傳剩餘的 API 使用量
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    gps_task = asyncio.create_task(start_station_gps())
+    await asyncio.gather(locker_cache.start(), api_usage_counter.start(), feedback_queue.start())
+    yield
+    gps_task.cancel()
+    await asyncio.gather(gps_task, return_exceptions=True)
+    await locker_cache.stop()
+    await api_usage_counter.stop()
+    await feedback_queue.stop()
+    await HttpClient.close()
+
 app = FastAPI(
     title="LockerMaps API",
+    lifespan=lifespan,
     docs_url=None,  # 停用預設的 docs
     redoc_url=None,  # 停用預設的 redoc
     openapi_url=None  # 停用預設的 openapi.json
@@ -52,8 +80,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Snapshot-Version", "X-Snapshot-Age"],
 )
 
+# 記錄各路由的延遲與回應大小（/metrics）
+app.add_middleware(MetricsMiddleware)
+
 # 引入路由
 app.include_router(locker_router.router)
 app.include_router(feedback_router.router)
@@ -81,8 +113,24 @@ def root():
 
 @app.get("/health")
 def health_check():
+    """存活檢查：程序可回應即為 ok"""
     return {"status": "ok"}
 
+@app.get("/ready")
+def readiness_check(response: Response):
+    """就緒檢查：已有置物櫃快照且站點座標已載入時回傳 200，否則回傳 503"""
+    snapshot = locker_cache.is_ready()
+    gps = StationGPSManager.is_ready()
+    if not (snapshot and gps):
+        response.status_code = 503
+    return {"status": "ok" if snapshot and gps else "starting", "snapshot": snapshot, "gps": gps}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 指標"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
 # FastAPI 初始化
 if __name__ == '__main__':
     import uvicorn
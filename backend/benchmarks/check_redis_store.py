@@ -0,0 +1,83 @@
+"""
+以 fakeredis 模擬 Redis，檢查 RedisSnapshotStore 的 leader 租約與快照共用
+
+不需要實際的 Redis：在本機啟動 fakeredis 的 TCP 伺服器，以多個 store 模擬多個 replica，確認：
+1. 同時只有一個 leader，其他 replica 無法取得租約
+2. leader 發布的快照，其他 replica 讀得到且只在版本較新時讀取
+3. leader touch() 更新的爬取時間，其他 replica 讀得到且只在有更新時讀取
+4. leader 停止續約後租約到期，由其他 replica 接手；原 leader 續約時得知已失去身分
+5. release() 只刪除自己的租約
+
+用法（於 backend/ 目錄，需安裝 requirements-optional.txt）：
+    python -m benchmarks.check_redis_store
+"""
+import socket
+import sys
+import threading
+import time
+
+from fakeredis import TcpFakeServer
+
+from services.snapshot_store import RedisSnapshotStore
+
+LEASE = 1.0     # 測試用的短租約（秒）
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def check(condition: bool, message: str):
+    print(f"{'OK  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        sys.exit(1)
+
+
+def main():
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"redis://127.0.0.1:{port}/0"
+
+    try:
+        first = RedisSnapshotStore(url, prefix="check", lease=LEASE)
+        second = RedisSnapshotStore(url, prefix="check", lease=LEASE)
+
+        check(first.try_acquire(), "第一個 replica 取得租約")
+        check(not second.try_acquire(), "第二個 replica 無法同時取得租約")
+        check(first.try_acquire(), "leader 續約成功")
+
+        check(second.read() is None, "尚未發布時讀不到快照")
+        first.publish(1, b"payload-1")
+        check(second.read() == b"payload-1", "其他 replica 讀到發布的快照")
+        check(second.read(known_version=1) is None, "版本沒有更新時不讀取內容")
+        first.publish(2, b"payload-2")
+        check(second.read(known_version=1) == b"payload-2", "讀到較新的版本")
+
+        check(second.read_fetched_at() is None, "尚未 touch() 時讀不到爬取時間")
+        first.touch({"MRT": 100.0})
+        check(second.read_fetched_at() == {"MRT": 100.0}, "其他 replica 讀到 touch() 的爬取時間")
+        check(second.read_fetched_at() is None, "爬取時間沒有更新時不重複讀取")
+        check(second.read(known_version=2) is None, "touch() 不改變快照版本")
+
+        # leader 停止續約（模擬程序中止），租約到期後由其他 replica 接手
+        time.sleep(LEASE * 1.5)
+        check(second.try_acquire(), "租約到期後其他 replica 接手")
+        check(not first.try_acquire(), "原 leader 續約時得知已失去 leader 身分")
+        check(not first.is_leader, "原 leader 已不是 leader")
+
+        first.release()
+        check(second.try_acquire(), "非 leader 的 release() 不影響目前的租約")
+        second.release()
+        check(first.try_acquire(), "leader release() 後其他 replica 可立即取得租約")
+        first.release()
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("RedisSnapshotStore 檢查完成")
+
+
+if __name__ == "__main__":
+    main()
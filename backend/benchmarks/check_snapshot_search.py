@@ -0,0 +1,102 @@
+"""
+檢查 LockerSnapshot.search() 的篩選結果
+
+以隨機站點建立快照，將空間索引的查詢結果與逐站比對（暴力法）的結果比較，
+涵蓋 bbox、near（radius / k）、type、size、min_empty 的各種組合，
+包含 near + bbox + k（k 筆必須在 bbox 篩選之後才取）。
+
+用法（於 backend/ 目錄）：
+    python -m benchmarks.check_snapshot_search
+"""
+import itertools
+import math
+import random
+import sys
+
+from services.locker_snapshot import LockerSnapshot
+
+SOURCES = ("MRT", "TRA")
+
+
+def build_snapshot(count: int, seed: int = 0) -> LockerSnapshot:
+    """建立 count 個站點的快照（座標直接傳入，不查詢 StationGPSManager）"""
+    rng = random.Random(seed)
+    data = {source: [] for source in SOURCES}
+    gps = {}
+    for i in range(count):
+        name = f"站點{i}"
+        gps[name] = {"lat": round(rng.uniform(24.9, 25.3), 6), "lng": round(rng.uniform(120.9, 121.3), 6)}
+        data[SOURCES[i % len(SOURCES)]].append({
+            "station": name,
+            "type": SOURCES[i % len(SOURCES)],
+            "tag": [],
+            "details": [
+                {"loc": f"{name} {size}", "id": j, "price": "", "size": size, "total": 10, "empty": rng.randint(0, 5)}
+                for j, size in enumerate(rng.sample("SML", rng.randint(1, 3)))
+            ],
+        })
+    return LockerSnapshot(data, 1.0, 1, gps=gps, pending=set())
+
+
+def haversine(lat1, lng1, lat2, lng2) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+def brute_force(snapshot, type=None, bbox=None, near=None, radius=None, k=None, size=None, min_empty=None) -> list:
+    """逐站篩選，回傳符合條件的站點名稱（near 時依距離排序）"""
+    matched = []
+    for station, source in zip(snapshot.stations, snapshot.station_sources):
+        if type in snapshot.data and source != type:
+            continue
+        if bbox is not None and not (bbox[0] <= station["lat"] <= bbox[2] and bbox[1] <= station["lng"] <= bbox[3]):
+            continue
+        if not any(
+            (size is None or detail["size"] == size)
+            and (min_empty is None or (detail["empty"] is not None and detail["empty"] >= min_empty))
+            for detail in station["details"]
+        ):
+            continue
+        distance = haversine(near[0], near[1], station["lat"], station["lng"]) if near is not None else 0
+        if radius is not None and distance > radius:
+            continue
+        matched.append((distance, station["station"]))
+    if near is not None:
+        matched.sort()
+        if k is not None:
+            matched = matched[:k]
+    return [name for _, name in matched]
+
+
+def main():
+    snapshot = build_snapshot(20)
+    options = {
+        "type": (None, "MRT"),
+        "bbox": (None, (25.06, 120.9, 25.3, 121.1), (25.0, 121.0, 25.2, 121.2)),
+        "near": (None, (25.0, 121.0)),
+        "radius": (None, 15000),
+        "k": (None, 1, 5),
+        "size": (None, "L"),
+        "min_empty": (None, 3),
+    }
+    failures = 0
+    cases = 0
+    for values in itertools.product(*options.values()):
+        params = dict(zip(options, values))
+        if params["near"] is None and (params["radius"] is not None or params["k"] is not None):
+            continue
+        cases += 1
+        expected = brute_force(snapshot, **params)
+        actual = [station["station"] for station in snapshot.search(**params)]
+        # 距離相同的站點順序可能不同，near 時比對集合與筆數
+        if (sorted(actual) if params["near"] else actual) != (sorted(expected) if params["near"] else expected):
+            failures += 1
+            print(f"FAIL {params}\n     預期 {expected}\n     實際 {actual}")
+    print(f"{cases - failures}/{cases} 個組合結果一致")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
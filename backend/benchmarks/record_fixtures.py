@@ -0,0 +1,35 @@
+"""
+錄製上游回應為 fixture
+
+從實際的上游抓取一次原始回應並寫入 fixtures/，供 stub_server 與 run_benchmarks 使用。
+用法（於 backend/ 目錄，需可連線至上游）：
+    python -m benchmarks.record_fixtures
+"""
+import asyncio
+
+from benchmarks.stub_server import FIXTURE_DIR
+from services import locker
+from util.http_client import HttpClient
+
+
+async def record():
+    requests = {
+        "mrt_station.html": HttpClient.request("GET", locker.MRT_URL),
+        "tra_lockerDatas.json": HttpClient.request("GET", locker.TRA_URL),
+        "owl_info.json": HttpClient.request("GET", locker.OWL_URL),
+        "metro_arena.json": HttpClient.request("POST", locker.METRO_LOCKER_URL, json={"Field": "arena", "Lang": "TW"}),
+        "metro_tcap.json": HttpClient.request("POST", locker.METRO_LOCKER_URL, json={"Field": "tcap", "Lang": "TW"}),
+    }
+    try:
+        responses = await asyncio.gather(*requests.values())
+    finally:
+        await HttpClient.close()
+
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    for name, response in zip(requests, responses):
+        (FIXTURE_DIR / name).write_bytes(response.content)
+        print(f"{name}: {len(response.content)} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(record())
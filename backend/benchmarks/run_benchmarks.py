@@ -0,0 +1,287 @@
+"""
+置物櫃爬蟲與 /Locker 離線效能測試
+
+使用 fixtures/ 的錄製回應與本地模擬伺服器，測量：
+1. parse：各來源解析時間
+2. refresh：從模擬上游完整更新所有來源並發布快照的延遲（每次都重新解析）
+   refresh_unchanged：上游內容未變動時的更新延遲（沿用上次解析結果、不重建快照）
+3. endpoint：/Locker 在並行負載下的吞吐量與延遲
+
+結果輸出為 JSON，可用 --compare 與前一次結果比較，找出效能退化。
+
+用法（於 backend/ 目錄）：
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.stub_server import FIXTURE_DIR, StubServer
+
+RESULT_DIR = Path(__file__).parent / "results"
+
+
+def isolate_environment(directory: str):
+    """
+    以程序內快照與暫存目錄執行，不覆寫實際的快照與座標檔，也不搶走執行中伺服器的 leader 鎖
+    （需在匯入 util.env 之前呼叫）
+    """
+    os.environ["SNAPSHOT_BACKEND"] = "memory"
+    os.environ["SNAPSHOT_PATH"] = os.path.join(directory, "locker_snapshot.bin")
+    os.environ["GPS_STORE_PATH"] = os.path.join(directory, "station_gps.json")
+    os.environ["FEEDBACK_QUEUE_PATH"] = os.path.join(directory, "feedback_queue.db")
+    os.environ["API_USAGE_PATH"] = os.path.join(directory, "api_usage.db")
+
+
+def summarize(samples: list) -> dict:
+    """將耗時樣本（秒）整理為毫秒統計"""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def seed_station_gps():
+    """為 fixture 中所有站點填入固定座標，避免測試時呼叫地理編碼服務"""
+    from services import locker
+    from util.config import StationGPSManager
+
+    raw = {
+        "mrt": (FIXTURE_DIR / "mrt_station.html").read_text(encoding="utf-8"),
+        "tra": json.loads((FIXTURE_DIR / "tra_lockerDatas.json").read_text(encoding="utf-8")),
+        "owl": json.loads((FIXTURE_DIR / "owl_info.json").read_text(encoding="utf-8")),
+        "arena": json.loads((FIXTURE_DIR / "metro_arena.json").read_text(encoding="utf-8")),
+        "tcap": json.loads((FIXTURE_DIR / "metro_tcap.json").read_text(encoding="utf-8")),
+    }
+    stations = (
+        locker.parseMRTLockerData(raw["mrt"])
+        + locker.parseTRALockerData(raw["tra"])
+        + locker.parseOWLockerData(raw["owl"])
+        + locker.parseArenaLockerData(raw["arena"])
+        + locker.parseTcapLockerData(raw["tcap"])
+        + locker.getKRTCLockerData()
+    )
+    rng = random.Random(0)
+    for station in stations:
+        StationGPSManager._cache.setdefault(station["station"], {
+            "lat": round(rng.uniform(22.5, 25.2), 6),
+            "lng": round(rng.uniform(120.2, 121.7), 6),
+        })
+
+
+def bench_parse(repeat: int) -> dict:
+    """各來源解析時間"""
+    from services import locker
+
+    html = (FIXTURE_DIR / "mrt_station.html").read_text(encoding="utf-8")
+    cases = {
+        "MRT": lambda: locker.parseMRTLockerData(html),
+        "MRT(html.parser)": lambda: locker.parseMRTLockerData(html, parser="html.parser"),
+        "TRA": lambda: locker.parseTRALockerData(json.loads((FIXTURE_DIR / "tra_lockerDatas.json").read_bytes())),
+        "OWL": lambda: locker.parseOWLockerData(json.loads((FIXTURE_DIR / "owl_info.json").read_bytes())),
+        "Arena": lambda: locker.parseArenaLockerData(json.loads((FIXTURE_DIR / "metro_arena.json").read_bytes())),
+        "Tcap": lambda: locker.parseTcapLockerData(json.loads((FIXTURE_DIR / "metro_tcap.json").read_bytes())),
+        "KRTC": locker.getKRTCLockerData,
+    }
+    results = {}
+    for name, func in cases.items():
+        func()  # 暖機
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        results[name] = summarize(samples)
+    return results
+
+
+async def bench_refresh(repeat: int) -> dict:
+    """從模擬上游完整更新所有來源並發布快照（清除上次的回應，每次都重新解析）"""
+    from services import locker
+    from services.locker_cache import locker_cache
+
+    sources = list(locker_cache._sources.values())
+    samples = []
+    for _ in range(repeat):
+        locker._upstream_state.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(locker_cache.refresh_source(source) for source in sources))
+        await locker_cache._publish()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_refresh_unchanged(repeat: int) -> dict:
+    """上游內容未變動時的更新：與背景更新相同（靜態來源不更新），資料沒有變動時不發布快照"""
+    from services.locker_cache import locker_cache
+
+    await asyncio.gather(*(locker_cache.refresh_source(source) for source in locker_cache._sources.values()))    # 記錄上游回應
+    await locker_cache._publish()
+    sources = [source for source in locker_cache._sources.values() if not source.static]
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        changed = await asyncio.gather(*(locker_cache.refresh_source(source) for source in sources))
+        if any(changed) or locker_cache.snapshot().gps_resolved():
+            await locker_cache._publish()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_endpoint(app, requests: int, concurrency: int) -> dict:
+    """/Locker 並行負載測試（in-process ASGI，不經過網路）"""
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        first = await client.get("/Locker", headers={"Accept-Encoding": "gzip"})
+        etag = first.headers.get("ETag", "")
+        scenarios = {
+            "full_gzip": ("/Locker", {"Accept-Encoding": "gzip"}),
+            "full_identity": ("/Locker", {"Accept-Encoding": "identity"}),
+            "not_modified": ("/Locker", {"If-None-Match": etag}),
+            "type_MRT": ("/Locker?type=MRT", {"Accept-Encoding": "gzip"}),
+            "near_k10": ("/Locker?near=25.04,121.52&k=10", {}),
+        }
+        for name, (url, headers) in scenarios.items():
+            samples = []
+            sizes = []
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.get(url, headers=headers)
+                    samples.append(time.perf_counter() - start)
+                    sizes.append(response.num_bytes_downloaded)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                **summarize(samples),
+                "requests_per_sec": round(requests / elapsed, 1),
+                "response_bytes": max(sizes),
+            }
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """比較兩次結果的 p50，回傳退化超過門檻的項目"""
+    regressions = []
+    for group in ("parse", "endpoint"):
+        for name, stats in current.get(group, {}).items():
+            old = baseline.get(group, {}).get(name)
+            if old and old["p50_ms"] > 0 and stats["p50_ms"] > old["p50_ms"] * (1 + threshold):
+                regressions.append(f"{group}.{name}: p50 {old['p50_ms']} ms -> {stats['p50_ms']} ms")
+    for name in ("refresh", "refresh_unchanged"):
+        old = baseline.get(name)
+        stats = current.get(name)
+        if old and stats and stats["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p50 {old['p50_ms']} ms -> {stats['p50_ms']} ms")
+    return regressions
+
+
+async def run(args) -> dict:
+    from services import locker
+    from services.locker_cache import locker_cache
+    from util.http_client import HttpClient
+    from app import app
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "mrt_parser": locker.MRT_HTML_PARSER,
+            "upstream_latency_s": args.latency,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+    }
+
+    seed_station_gps()
+    result["parse"] = bench_parse(args.repeat)
+
+    with StubServer(latency=args.latency) as server:
+        for name, url in server.upstream_urls().items():
+            setattr(locker, name, url)
+        result["refresh"] = await bench_refresh(max(args.repeat // 5, 3))
+        result["refresh_unchanged"] = await bench_refresh_unchanged(max(args.repeat // 5, 3))
+
+        await locker_cache.start()
+        try:
+            result["endpoint"] = await bench_endpoint(app, args.requests, args.concurrency)
+        finally:
+            await locker_cache.stop()
+            await HttpClient.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LockerMaps 離線效能測試")
+    parser.add_argument("--repeat", type=int, default=30, help="解析測試重複次數")
+    parser.add_argument("--requests", type=int, default=2000, help="每個 /Locker 情境的請求數")
+    parser.add_argument("--concurrency", type=int, default=50, help="/Locker 並行請求數")
+    parser.add_argument("--latency", type=float, default=0.0, help="模擬上游延遲（秒）")
+    parser.add_argument("--output", type=Path, default=None, help="結果 JSON 路徑")
+    parser.add_argument("--compare", type=Path, default=None, help="與先前的結果 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的 p50 增幅（0.2 = 20%%）")
+    parser.add_argument("--verbose", action="store_true", help="保留伺服器日誌輸出")
+    args = parser.parse_args()
+
+    # 日誌輸出仍會執行（反映實際成本），只是不顯示
+    with tempfile.TemporaryDirectory(prefix="lockermaps-bench-") as directory, open(os.devnull, "w") as devnull:
+        isolate_environment(directory)
+        redirect = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with redirect:
+            result = asyncio.run(run(args))
+
+    output = args.output or RESULT_DIR / f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"結果已寫入 {output}")
+
+    if args.compare:
+        regressions = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.threshold)
+        if regressions:
+            print("效能退化：")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("沒有超過門檻的效能退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+本地上游模擬伺服器
+
+以 fixtures/ 中錄製的回應模擬各置物櫃來源，讓爬蟲與 /Locker 可以離線重複測量。
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures"
+
+# (method, path) -> (fixture 檔名, Content-Type)；POST lockersinfoforrb 依 body 的 Field 決定
+ROUTES = {
+    ("GET", "/metro/locker/station"): ("mrt_station.html", "text/html; charset=utf-8"),
+    ("GET", "/lockerDatas"): ("tra_lockerDatas.json", "application/json"),
+    ("GET", "/api/info"): ("owl_info.json", "application/json"),
+}
+METRO_FIELDS = {
+    "arena": "metro_arena.json",
+    "tcap": "metro_tcap.json",
+}
+
+
+def load_fixtures() -> dict:
+    """讀取所有 fixture：{檔名: bytes}"""
+    return {path.name: path.read_bytes() for path in FIXTURE_DIR.iterdir() if path.is_file()}
+
+
+class StubServer:
+    """
+    在背景執行緒啟動的上游模擬伺服器
+
+    Args:
+        latency (float): 每個請求額外延遲的秒數，用於模擬上游回應時間。
+        port (int): 監聽埠號，0 表示自動選擇。
+    """
+
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        fixtures = load_fixtures()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, name, content_type):
+                if latency:
+                    time.sleep(latency)
+                body = fixtures[name]
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                route = ROUTES.get(("GET", self.path))
+                if route is None:
+                    self.send_error(404)
+                    return
+                self._send(*route)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                name = METRO_FIELDS.get(payload.get("Field"))
+                if self.path != "/apis/metrostationapi/lockersinfoforrb" or name is None:
+                    self.send_error(404)
+                    return
+                self._send(name, "application/json")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def upstream_urls(self) -> dict:
+        """對應 services.locker 中各來源網址常數"""
+        return {
+            "MRT_URL": f"{self.base_url}/metro/locker/station",
+            "TRA_URL": f"{self.base_url}/lockerDatas",
+            "OWL_URL": f"{self.base_url}/api/info",
+            "METRO_LOCKER_URL": f"{self.base_url}/apis/metrostationapi/lockersinfoforrb",
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="啟動本地上游模擬伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的額外延遲（秒）")
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency, port=args.port) as server:
+        print(f"Stub upstream: {server.base_url}")
+        for name, url in server.upstream_urls().items():
+            print(f"  {name} = {url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -1,13 +1,40 @@
+import asyncio
+import os
+import sqlite3
 import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
 from typing import Dict
-from firebase_admin import firestore
 
+from util.env import Env
+from util.firebase import Firebase
 from util.nowtime import TaiwanTime
 from util.logger import Log, Color
 
 
 class APIUsageCounter:
-    """單例：記錄 API 使用次數（日期 -> 次數），並支援與 Firebase 合併。"""
+    """
+    單例：記錄 API 使用次數（日期 -> 次數，含各端點與各 type 的細項），並定期以增量上傳 Firebase。
+
+    每個執行緒各自累加在自己的分片（thread-local dict），呼叫 increment() 時不需取得鎖；
+    讀取或上傳時才彙總所有分片，扣掉已上傳的基準值即為尚未上傳的增量。
+    執行緒結束時（例如閒置的 worker 執行緒被回收）其分片併入共用的累計，分片數不會隨時間增加；
+    今天以前且已全部上傳的日期會在上傳後移除。
+    上傳時只送出增量（Firestore Increment 由伺服器端累加），成本只與本次有變動的日期數有關。
+
+    增量每 SAVE_INTERVAL 秒寫入本地 SQLite（WAL 模式，所有 worker 共用），worker 被強制中止時最多遺失這段時間的計數；
+    上傳時先認領資料庫中的增量（含其他 worker 與上次執行留下的），提交成功後才刪除，失敗時釋放留待下次。
+    認領後程序中止時，認領逾時（CLAIM_TIMEOUT）後由其他 worker 或下次啟動重新上傳。
+    無法開啟本地資料庫時只保留在記憶體中。
+    """
+
+    SAVE_INTERVAL = 5       # 寫入本地資料庫的間隔（秒）
+    FLUSH_INTERVAL = 300    # 背景自動上傳間隔（秒）
+    CLAIM_TIMEOUT = 600     # 認領後超過此秒數仍未完成上傳，視為上傳的 worker 已中止
 
     _instance = None
     _instance_lock = threading.Lock()
@@ -17,82 +44,292 @@ class APIUsageCounter:
             with cls._instance_lock:
                 if cls._instance is None:
                     cls._instance = super().__new__(cls)
-                    cls._instance._lock = threading.Lock()
-                    cls._instance._usage_by_date = {}  # 本地增量資料：{date: count}
+                    cls._instance._lock = threading.Lock()      # 只保護分片列表與基準值
+                    cls._instance._local = threading.local()
+                    cls._instance._shards = []      # 各執行緒的累計次數：{(date, endpoint, type): count}
+                    cls._instance._retired = {}     # 已結束執行緒的累計次數
+                    cls._instance._flushed = {}     # 已寫入本地資料庫或已上傳的累計次數（基準值）
+                    cls._instance._today = None     # 目前日期字串，每天只計算一次
+                    cls._instance._today_ends = 0.0 # 目前日期結束的 epoch 秒數
+                    cls._instance._flush_lock = threading.Lock()  # 避免同一份增量被重複上傳
+                    cls._instance._path = Path(Env.API_USAGE_PATH)
+                    cls._instance._conn = None
+                    cls._instance._db_lock = threading.Lock()
+                    cls._instance._task = None
         return cls._instance
 
-    def increment(self) -> int:
-        """每次 API 被呼叫時 +1，回傳當日最新次數。"""
-        today = TaiwanTime.string(time=False)
+    def _connect(self) -> sqlite3.Connection:
+        """開啟本地資料庫（在 start() 時呼叫）"""
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS api_usage_pending ("
+                " date TEXT NOT NULL,"
+                " endpoint TEXT NOT NULL,"
+                " type TEXT NOT NULL DEFAULT '',"
+                " count INTEGER NOT NULL,"
+                " claimed_by TEXT,"
+                " claimed_at REAL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _date_key(self) -> str:
+        """取得台灣日期字串；只在跨日時重新計算"""
+        if time.time() >= self._today_ends:
+            now = TaiwanTime.now()
+            tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            self._today, self._today_ends = now.strftime("%Y-%m-%d"), tomorrow.timestamp()
+        return self._today
+
+    def _shard(self) -> dict:
+        """取得目前執行緒的分片，第一次使用時註冊"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # 執行緒結束時 thread-local 的內容會被釋放，以此觸發分片回收
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard: dict):
+        """執行緒結束：將其分片併入共用的累計並移除分片"""
+        with self._lock:
+            for key, count in shard.items():
+                self._retired[key] = self._retired.get(key, 0) + count
+            self._shards = [item for item in self._shards if item is not shard]
+
+    def _totals(self) -> Counter:
+        """彙總所有分片與已結束執行緒的累計次數（需持有 _lock）"""
+        totals = Counter(self._retired)
+        for shard in self._shards:
+            totals.update(dict(shard))  # dict() 複製在 GIL 下是原子操作，不會與寫入端衝突
+        return totals
+
+    def increment(self, endpoint: str = "/Locker", type: str = None):
+        """
+        每次 API 被呼叫時 +1（不取得鎖，只寫入目前執行緒的分片）。
+        Args:
+            endpoint: 被呼叫的端點
+            type: 查詢的資料來源，None 表示未指定
+        """
+        shard = self._shard()
+        key = (self._date_key(), endpoint, type)
+        shard[key] = shard.get(key, 0) + 1
+
+    def _pending(self) -> Dict[tuple, int]:
+        """彙總所有分片，回傳尚未上傳的增量：{(date, endpoint, type): count}"""
         with self._lock:
-            self._usage_by_date[today] = self._usage_by_date.get(today, 0) + 1
-            return self._usage_by_date[today]
+            totals = self._totals()
+            flushed = dict(self._flushed)
+        return {key: count - flushed.get(key, 0) for key, count in totals.items() if count > flushed.get(key, 0)}
 
-    def get_local_usage(self) -> Dict[str, int]:
-        """取得目前本地尚未同步的 API 使用量（日期 -> 次數）。"""
+    def _advance(self, pending: Dict[tuple, int]):
+        """將已寫入本地資料庫或已上傳的增量計入基準值"""
         with self._lock:
-            return dict(self._usage_by_date)
+            for key, count in pending.items():
+                self._flushed[key] = self._flushed.get(key, 0) + count
+
+    def _save(self) -> bool:
+        """
+        將記憶體中的增量寫入本地資料庫（需持有 _flush_lock）
+        Returns:
+            bool: 記憶體中的增量是否都已保存（沒有本地資料庫或寫入失敗時為 False）
+        """
+        if self._conn is None:
+            return False
+        pending = self._pending()
+        if not pending:
+            return True
+        with self._db_lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO api_usage_pending (date, endpoint, type, count) VALUES (?, ?, ?, ?)",
+                    [(date, endpoint, type or "", count) for (date, endpoint, type), count in pending.items()],
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                Log(f"❌ API 使用量寫入本地資料庫失敗: {str(e)}", color=Color.RED)
+                return False
+        self._advance(pending)
+        return True
+
+    def save(self):
+        """將記憶體中的增量寫入本地資料庫"""
+        with self._flush_lock:
+            self._save()
+
+    def _claim(self) -> tuple:
+        """
+        認領本地資料庫中尚未上傳的增量（含其他 worker 寫入的，及認領逾時的）
+        Returns:
+            tuple: (認領 ID, {(date, endpoint, type): count})；沒有本地資料庫或讀取失敗時為 (None, {})
+        """
+        if self._conn is None:
+            return None, {}
+        token = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        with self._db_lock:
+            try:
+                # UPDATE 取得寫入鎖，同一個交易內的 SELECT 只會讀到自己認領的資料
+                self._conn.execute(
+                    "UPDATE api_usage_pending SET claimed_by = ?, claimed_at = ? WHERE claimed_by IS NULL OR claimed_at < ?",
+                    (token, now, now - self.CLAIM_TIMEOUT),
+                )
+                rows = self._conn.execute(
+                    "SELECT date, endpoint, type, SUM(count) FROM api_usage_pending WHERE claimed_by = ? GROUP BY date, endpoint, type",
+                    (token,),
+                ).fetchall()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                Log(f"❌ 無法讀取本地 API 使用量: {str(e)}", color=Color.RED)
+                return None, {}
+        return token, {(date, endpoint, type or None): count for date, endpoint, type, count in rows}
+
+    def _finish_claim(self, token: str, uploaded: bool):
+        """上傳成功時刪除認領的增量，失敗時釋放留待下次上傳"""
+        if token is None:
+            return
+        with self._db_lock:
+            try:
+                if uploaded:
+                    self._conn.execute("DELETE FROM api_usage_pending WHERE claimed_by = ?", (token,))
+                else:
+                    self._conn.execute("UPDATE api_usage_pending SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?", (token,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                Log(f"❌ 無法更新本地 API 使用量: {str(e)}", color=Color.RED)
+
+    @staticmethod
+    def _group(pending: Dict[tuple, int]) -> list:
+        """依日期彙總增量：[(date, count, {endpoint: count}, {type: count}), ...]"""
+        by_date = {}
+        for (date, endpoint, type), count in pending.items():
+            total, endpoints, types = by_date.setdefault(date, [0, Counter(), Counter()])
+            by_date[date][0] = total + count
+            endpoints[endpoint] += count
+            if type is not None:
+                types[type] += count
+        return [(date, total, dict(endpoints), dict(types)) for date, (total, endpoints, types) in by_date.items()]
 
     def upload_usage(self) -> dict:
         """
-        先抓取 Firebase 的歷史資料，再與本地資料合併後回寫。
-        若日期重疊，次數相加。
+        將本地增量以 Firestore Increment 上傳（每個日期一次寫入，整批提交）。
+        先將記憶體中的增量寫入本地資料庫再整批認領；沒有本地資料庫時直接上傳記憶體中的增量。
+        提交成功後才刪除認領的增量、更新已上傳的基準值，失敗時保留至下次上傳。
+        Returns:
+            dict: local_uploaded（日期 -> 次數）、uploaded_dates（日期數）、
+                  breakdown（日期 -> {"endpoints": {...}, "types": {...}}，本次上傳的各端點、各 type 次數）
         """
+        with self._flush_lock:
+            memory = {} if self._save() else self._pending()
+            token, claimed = self._claim()
+            pending = Counter(claimed)
+            pending.update(memory)
+            if not pending:
+                return {"local_uploaded": {}, "uploaded_dates": 0, "breakdown": {}}
+
+            try:
+                db = Firebase.get_db()
+                batch = db.batch()
+                now = TaiwanTime.now()
+                local_snapshot = {}
+                breakdown = {}
+                for date, count, endpoints, types in self._group(pending):
+                    local_snapshot[date] = count
+                    breakdown[date] = {"endpoints": endpoints, "types": types}
+                    doc_ref = db.collection("api_usage_daily").document(date)
+                    batch.set(
+                        doc_ref,
+                        {
+                            "date": date,
+                            "count": Firebase.firestore().Increment(count),
+                            "endpoints": {name: Firebase.firestore().Increment(value) for name, value in endpoints.items()},
+                            "types": {name: Firebase.firestore().Increment(value) for name, value in types.items()},
+                            "updated_at": now,
+                        },
+                        merge=True,
+                    )
+                batch.commit()
+
+                # 只把這次上傳的增量計入基準值，上傳期間新增的計數留待下次
+                self._finish_claim(token, uploaded=True)
+                self._advance(memory)
+                self._prune()
+
+                Log(
+                    f"✅ API 使用量已上傳 | 日期數: {len(local_snapshot)} | 次數: {sum(local_snapshot.values())}",
+                    color=Color.GREEN,
+                )
+                return {
+                    "local_uploaded": local_snapshot,
+                    "uploaded_dates": len(local_snapshot),
+                    "breakdown": breakdown,
+                }
+            except Exception as e:
+                self._finish_claim(token, uploaded=False)
+                Log(f"❌ API 使用量上傳失敗: {str(e)}", color=Color.RED)
+                raise Exception(f"API 使用量上傳失敗: {str(e)}")
+
+    def _prune(self):
+        """移除今天以前且已全部上傳的日期（分片、已結束執行緒的累計與基準值），避免隨時間累積"""
+        today = self._date_key()
         with self._lock:
-            local_snapshot = dict(self._usage_by_date)
+            done = [
+                key for key, count in self._totals().items()
+                if key[0] < today and count <= self._flushed.get(key, 0)
+            ]
+            for key in done:
+                self._flushed.pop(key, None)
+                self._retired.pop(key, None)
+                for shard in self._shards:
+                    shard.pop(key, None)    # 舊日期不會再被寫入，可以直接移除
+
+    async def _flush_loop(self):
+        """背景定期寫入本地資料庫並定期上傳"""
+        next_upload = time.monotonic() + self.FLUSH_INTERVAL
+        while True:
+            await asyncio.sleep(self.SAVE_INTERVAL if self._conn is not None else self.FLUSH_INTERVAL)
+            try:
+                if time.monotonic() >= next_upload:
+                    next_upload = time.monotonic() + self.FLUSH_INTERVAL
+                    await asyncio.to_thread(self.upload_usage)
+                else:
+                    await asyncio.to_thread(self.save)
+            except Exception:
+                pass    # 已記錄日誌，增量保留至下次上傳
 
+    async def start(self):
+        """開啟本地資料庫並啟動背景自動上傳；無法開啟本地資料庫時增量只保留在記憶體中"""
         try:
-            db = firestore.client()
-            firebase_usage: Dict[str, int] = {}
-
-            for doc in db.collection("api_usage_daily").stream():
-                raw = doc.to_dict() or {}
-                date = raw.get("date", doc.id)
-                count = raw.get("count", 0)
-                try:
-                    firebase_usage[date] = int(count)
-                except (TypeError, ValueError):
-                    firebase_usage[date] = 0
-
-            merged_usage: Dict[str, int] = dict(firebase_usage)
-            for date, count in local_snapshot.items():
-                merged_usage[date] = merged_usage.get(date, 0) + count
-
-            batch = db.batch()
-            now = TaiwanTime.now()
-            for date, count in merged_usage.items():
-                doc_ref = db.collection("api_usage_daily").document(date)
-                batch.set(
-                    doc_ref,
-                    {
-                        "date": date,
-                        "count": count,
-                        "updated_at": now,
-                    },
-                    merge=True,
-                )
-            batch.commit()
+            with self._db_lock:
+                self._connect()
+        except (OSError, sqlite3.Error) as e:
+            Log(f"⚠️ 無法開啟 API 使用量資料庫 {self._path}: {str(e)}，增量只保留在記憶體中", color=Color.YELLOW)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止背景上傳，並在關閉前上傳剩餘的增量"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self.upload_usage)
+        except Exception:
+            pass
+
+class _ShardOwner:
+    """綁定在 thread-local 上，執行緒結束時被回收，用來觸發分片回收（object() 不支援 weakref）"""
 
-            # 只清掉這次快照裡已同步的增量，避免上傳期間新增的計數遺失
-            with self._lock:
-                for date, synced_count in local_snapshot.items():
-                    current = self._usage_by_date.get(date, 0) - synced_count
-                    if current > 0:
-                        self._usage_by_date[date] = current
-                    else:
-                        self._usage_by_date.pop(date, None)
-
-            Log(
-                f"✅ API 使用量已合併上傳 | 本地日期數: {len(local_snapshot)} | Firebase總日期數: {len(merged_usage)}",
-                color=Color.GREEN,
-            )
-            return {
-                "local_uploaded": local_snapshot,
-                "merged_usage": merged_usage,
-                "merged_dates": len(merged_usage),
-            }
-        except Exception as e:
-            Log(f"❌ API 使用量合併上傳失敗: {str(e)}", color=Color.RED)
-            raise Exception(f"API 使用量合併上傳失敗: {str(e)}")
 
 api_usage_counter = APIUsageCounter()
@@ -1,6 +1,7 @@
-from firebase_admin import firestore
 from typing import Optional
+import time
 
+from util.firebase import Firebase
 from util.nowtime import TaiwanTime
 from util.logger import Log, Color
 
@@ -8,18 +9,41 @@ class FeedbackService:
     """
     意見回饋服務層
     負責處理意見回饋的 Firebase 儲存與查詢
+    
+    統計資料存放在 feedback_stats/summary 計數文件，
+    建立回饋與更新狀態時在同一個交易中增減計數，查詢統計只需讀取一份文件。
     """
     
-    # 初始化 Firebase (StationGPSManager 已初始化)
+    FEEDBACK_TYPES = ("suggestion", "bug", "data", "other")
+    FEEDBACK_STATUSES = ("pending", "processing", "resolved")
+    STATS_CACHE_TTL = 30    # 統計資料的程序內快取秒數
+    
     _db = None
+    _stats_cache = None     # (到期時間, 統計資料)
     
     @classmethod
     def _get_db(cls):
-        """取得 Firestore 資料庫實例"""
+        """取得 Firestore 資料庫實例（第一次使用時才初始化 Firebase）"""
         if cls._db is None:
-            cls._db = firestore.client()
+            cls._db = Firebase.get_db()
         return cls._db
     
+    @classmethod
+    def _get_stats_ref(cls):
+        """取得統計計數文件"""
+        return cls._get_db().collection("feedback_stats").document("summary")
+    
+    @staticmethod
+    def _stats_delta(total: int = 0, by_type: Optional[dict] = None, by_status: Optional[dict] = None) -> dict:
+        """組成計數文件的增量更新（搭配 merge=True 使用）"""
+        delta = {
+            "by_type": {key: Firebase.firestore().Increment(value) for key, value in (by_type or {}).items()},
+            "by_status": {key: Firebase.firestore().Increment(value) for key, value in (by_status or {}).items()},
+        }
+        if total:
+            delta["total"] = Firebase.firestore().Increment(total)
+        return delta
+    
     @classmethod
     def create_feedback(
         cls,
@@ -29,7 +53,10 @@ class FeedbackService:
         email: Optional[str] = None
     ) -> str:
         """
-        建立新的意見回饋並存入 Firebase
+        建立新的意見回饋並排入寫入佇列
+        
+        回饋先寫入本地佇列後立即回傳，由背景任務整批寫入 Firebase（見 write_feedbacks）；
+        本地佇列無法使用時（例如資料目錄沒有寫入權限）直接寫入 Firebase。
         
         參數:
         - feedback_type: 回饋類型 (suggestion/bug/data/other)
@@ -38,11 +65,11 @@ class FeedbackService:
         - email: Email (選填)
         
         回傳:
-        - feedback_id: Firebase 文件 ID
+        - feedback_id: Firebase 文件 ID（本地預先產生）
         """
+        from services.feedback_queue import feedback_queue, auto_id
+        
         try:
-            db = cls._get_db()
-            
             # 準備回饋資料
             feedback_data = {
                 "type": feedback_type,
@@ -56,11 +83,15 @@ class FeedbackService:
                 "notes": ""
             }
             
-            # 存入 Firebase feedbacks 集合
-            doc_ref = db.collection("feedbacks").add(feedback_data)
-            feedback_id = doc_ref[1].id
+            try:
+                feedback_id = feedback_queue.enqueue(feedback_data)
+            except Exception as e:
+                Log(f"⚠️ 意見回饋佇列無法使用，直接寫入 Firebase: {str(e)}", color=Color.YELLOW)
+                feedback_id = auto_id()
+                cls.write_feedbacks({feedback_id: feedback_data})
+                return feedback_id
             
-            Log(f"✅ 意見回饋已建立 | ID: {feedback_id} | 類型: {feedback_type} | 提交者: {name}", color=Color.GREEN)
+            Log(f"✅ 意見回饋已排入佇列 | ID: {feedback_id} | 類型: {feedback_type} | 提交者: {name}", color=Color.GREEN)
             
             return feedback_id
             
@@ -68,49 +99,103 @@ class FeedbackService:
             Log(f"❌ 建立意見回饋失敗: {str(e)}", color=Color.RED)
             raise Exception(f"建立意見回饋失敗: {str(e)}")
     
+    @classmethod
+    def write_feedbacks(cls, feedbacks: dict) -> int:
+        """
+        將多筆回饋寫入 Firebase feedbacks 集合，並在同一個交易中更新統計計數
+        
+        已存在的文件（先前的寫入其實已成功）會略過，重試時不會重複計數。
+        
+        參數:
+        - feedbacks: {feedback_id: 回饋資料}
+        
+        回傳:
+        - int: 實際新建立的文件數
+        """
+        db = cls._get_db()
+        stats_ref = cls._get_stats_ref()
+        refs = {feedback_id: db.collection("feedbacks").document(feedback_id) for feedback_id in feedbacks}
+        
+        @Firebase.firestore().transactional
+        def write_in_transaction(transaction):
+            existing = {snapshot.id for snapshot in transaction.get_all(list(refs.values())) if snapshot.exists}
+            # 計數文件尚未建立時不增加計數，待第一次查詢統計時以聚合查詢建立
+            stats_exists = stats_ref.get(transaction=transaction).exists
+            by_type, by_status = {}, {}
+            created = 0
+            for feedback_id, data in feedbacks.items():
+                if feedback_id in existing:
+                    continue
+                transaction.set(refs[feedback_id], data)
+                by_type[data["type"]] = by_type.get(data["type"], 0) + 1
+                by_status[data["status"]] = by_status.get(data["status"], 0) + 1
+                created += 1
+            if stats_exists and created:
+                transaction.set(stats_ref, cls._stats_delta(created, by_type, by_status), merge=True)
+            return created
+        
+        created = write_in_transaction(db.transaction())
+        cls._stats_cache = None
+        Log(f"✅ 意見回饋已寫入 Firebase | 筆數: {created}", color=Color.GREEN)
+        return created
+    
+    @classmethod
+    def _count_feedbacks(cls, transaction=None) -> dict:
+        """以 Firestore 聚合查詢計算統計（只在計數文件不存在時使用）"""
+        feedbacks_ref = cls._get_db().collection("feedbacks")
+        
+        def count(query) -> int:
+            return int(query.count().get(transaction=transaction)[0][0].value)
+        
+        return {
+            "total": count(feedbacks_ref),
+            "by_type": {
+                feedback_type: count(feedbacks_ref.where(filter=Firebase.firestore().FieldFilter("type", "==", feedback_type)))
+                for feedback_type in cls.FEEDBACK_TYPES
+            },
+            "by_status": {
+                status: count(feedbacks_ref.where(filter=Firebase.firestore().FieldFilter("status", "==", status)))
+                for status in cls.FEEDBACK_STATUSES
+            },
+        }
+    
     @classmethod
     def get_feedback_stats(cls) -> dict:
         """
         取得意見回饋統計資料
         
+        讀取計數文件（短時間內的重複查詢直接使用程序內快取）；
+        計數文件不存在時以聚合查詢計算並建立。
+        
         回傳:
         - dict: 包含各類型回饋的數量統計
         """
+        cached = cls._stats_cache
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
         try:
             db = cls._get_db()
+            stats_ref = cls._get_stats_ref()
             
-            # 取得所有回饋
-            feedbacks_ref = db.collection("feedbacks")
-            feedbacks = feedbacks_ref.stream()
+            @Firebase.firestore().transactional
+            def load_in_transaction(transaction):
+                snapshot = stats_ref.get(transaction=transaction)
+                if snapshot.exists:
+                    return snapshot.to_dict()
+                Log("📊 建立意見回饋統計計數文件", color=Color.ORANGE)
+                data = cls._count_feedbacks(transaction)
+                transaction.set(stats_ref, data)
+                return data
+            
+            data = load_in_transaction(db.transaction())
             
             stats = {
-                "total": 0,
-                "by_type": {
-                    "suggestion": 0,
-                    "bug": 0,
-                    "data": 0,
-                    "other": 0
-                },
-                "by_status": {
-                    "pending": 0,
-                    "processing": 0,
-                    "resolved": 0
-                }
+                "total": data.get("total", 0),
+                "by_type": {key: data.get("by_type", {}).get(key, 0) for key in cls.FEEDBACK_TYPES},
+                "by_status": {key: data.get("by_status", {}).get(key, 0) for key in cls.FEEDBACK_STATUSES},
             }
-            
-            for feedback in feedbacks:
-                data = feedback.to_dict()
-                stats["total"] += 1
-                
-                # 統計類型
-                feedback_type = data.get("type", "other")
-                if feedback_type in stats["by_type"]:
-                    stats["by_type"][feedback_type] += 1
-                
-                # 統計狀態
-                status = data.get("status", "pending")
-                if status in stats["by_status"]:
-                    stats["by_status"][status] += 1
+            cls._stats_cache = (time.monotonic() + cls.STATS_CACHE_TTL, stats)
             
             Log(f"📊 意見回饋統計 | 總數: {stats['total']}", color=Color.BLUE)
             
@@ -135,7 +220,7 @@ class FeedbackService:
             db = cls._get_db()
             
             feedbacks_ref = db.collection("feedbacks") \
-                             .order_by("created_at", direction=firestore.Query.DESCENDING) \
+                             .order_by("created_at", direction=Firebase.firestore().Query.DESCENDING) \
                              .limit(limit)
             
             feedbacks = feedbacks_ref.stream()
@@ -187,7 +272,23 @@ class FeedbackService:
             if notes:
                 update_data["notes"] = notes
             
-            db.collection("feedbacks").document(feedback_id).update(update_data)
+            doc_ref = db.collection("feedbacks").document(feedback_id)
+            stats_ref = cls._get_stats_ref()
+            
+            @Firebase.firestore().transactional
+            def update_in_transaction(transaction):
+                # 讀取原本的狀態，狀態改變時同步調整統計計數
+                snapshot = doc_ref.get(transaction=transaction)
+                if not snapshot.exists:
+                    raise Exception(f"找不到意見回饋 {feedback_id}")
+                stats_exists = stats_ref.get(transaction=transaction).exists
+                old_status = (snapshot.to_dict() or {}).get("status", "pending")
+                transaction.update(doc_ref, update_data)
+                if stats_exists and old_status != status:
+                    transaction.set(stats_ref, cls._stats_delta(by_status={old_status: -1, status: 1}), merge=True)
+            
+            update_in_transaction(db.transaction())
+            cls._stats_cache = None
             
             Log(f"✅ 意見回饋狀態已更新 | ID: {feedback_id} | 狀態: {status}", color=Color.GREEN)
             
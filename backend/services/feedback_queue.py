@@ -0,0 +1,177 @@
+import asyncio
+import json
+import secrets
+import sqlite3
+import string
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from util.env import Env
+from util.logger import Log, Color
+
+AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+
+def auto_id() -> str:
+    """產生與 Firestore 自動 ID 相同格式的文件 ID（20 個英數字元）"""
+    return "".join(secrets.choice(AUTO_ID_CHARS) for _ in range(20))
+
+
+class FeedbackQueue:
+    """
+    意見回饋寫入佇列（單例模式）
+
+    送出的回饋先寫入本地 SQLite（WAL 模式，程序中止也不會遺失），立即回應使用者；
+    背景任務再整批寫入 Firebase，失敗時以指數退避重試。
+    文件 ID 在本地產生，寫入時先確認文件是否已存在，重試不會重複建立或重複計數。
+    """
+
+    BATCH_SIZE = 200        # 每批最多寫入的回饋數（Firestore 每次提交上限 500 筆寫入）
+    FLUSH_INTERVAL = 5      # 沒有新回饋時的檢查間隔（秒）
+    RETRY_BASE = 2          # 重試等待的基數（秒）
+    RETRY_MAX = 300         # 重試等待上限（秒）
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._path = Path(Env.FEEDBACK_QUEUE_PATH)
+            cls._instance._conn = None
+            cls._instance._lock = threading.Lock()
+            cls._instance._wakeup = None    # asyncio.Event，有新回饋時喚醒背景任務
+            cls._instance._loop = None
+            cls._instance._task = None
+        return cls._instance
+
+    def _connect(self) -> sqlite3.Connection:
+        """第一次使用時開啟資料庫"""
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS feedback_queue ("
+                " id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL DEFAULT 0)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM feedback_queue").fetchone()[0]
+
+    def enqueue(self, feedback_data: dict) -> str:
+        """
+        將一筆回饋寫入本地佇列
+        Args:
+            feedback_data: 回饋文件內容（created_at 等 datetime 會轉成 ISO 字串保存）
+        Returns:
+            str: 預先產生的文件 ID
+        """
+        feedback_id = auto_id()
+        data = json.dumps(
+            {key: {"$datetime": value.isoformat()} if isinstance(value, datetime) else value for key, value in feedback_data.items()},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT INTO feedback_queue (id, data) VALUES (?, ?)", (feedback_id, data))
+            conn.commit()
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return feedback_id
+
+    def _due(self) -> list:
+        """取出已到重試時間的回饋：[(id, data, attempts), ...]"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, data, attempts FROM feedback_queue WHERE next_attempt <= ? ORDER BY rowid LIMIT ?",
+                (time.time(), self.BATCH_SIZE),
+            ).fetchall()
+        return [
+            (feedback_id, {key: datetime.fromisoformat(value["$datetime"]) if isinstance(value, dict) and "$datetime" in value else value
+                           for key, value in json.loads(data).items()}, attempts)
+            for feedback_id, data, attempts in rows
+        ]
+
+    def flush(self) -> int:
+        """
+        將到期的回饋整批寫入 Firebase
+        Returns:
+            int: 寫入成功的筆數；失敗時延後重試並回傳 0
+        """
+        from services.feedback import FeedbackService
+
+        try:
+            items = self._due()
+        except (OSError, sqlite3.Error) as e:
+            Log(f"❌ 無法讀取意見回饋佇列: {str(e)}", color=Color.RED)
+            return 0
+        if not items:
+            return 0
+        ids = [feedback_id for feedback_id, _, _ in items]
+        try:
+            FeedbackService.write_feedbacks({feedback_id: data for feedback_id, data, _ in items})
+        except Exception as e:
+            Log(f"❌ 意見回饋寫入失敗，稍後重試 | 筆數: {len(items)} | {str(e)}", color=Color.RED)
+            now = time.time()
+            with self._lock:
+                conn = self._connect()
+                conn.executemany(
+                    "UPDATE feedback_queue SET attempts = ?, next_attempt = ? WHERE id = ?",
+                    [(attempts + 1, now + min(self.RETRY_MAX, self.RETRY_BASE ** (attempts + 1)), feedback_id)
+                     for feedback_id, _, attempts in items],
+                )
+                conn.commit()
+            return 0
+
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM feedback_queue WHERE id = ?", [(feedback_id,) for feedback_id in ids])
+            conn.commit()
+        return len(ids)
+
+    async def _flush_loop(self):
+        """背景任務：有新回饋或定期檢查時寫入 Firebase"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # 一次寫滿一批時繼續寫下一批
+            while await asyncio.to_thread(self.flush) >= self.BATCH_SIZE:
+                pass
+
+    async def start(self):
+        """啟動背景寫入任務（會先寫入上次未完成的回饋）；無法開啟本地資料庫時不啟動，回饋改為直接寫入 Firebase"""
+        try:
+            with self._lock:
+                self._connect()
+        except (OSError, sqlite3.Error) as e:
+            Log(f"⚠️ 無法開啟意見回饋佇列 {self._path}: {str(e)}，改為直接寫入 Firebase", color=Color.YELLOW)
+            return
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """停止背景寫入任務，並嘗試寫入剩餘的回饋（失敗的留在本地，下次啟動再寫）"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._loop = None
+        if self._conn is not None:
+            await asyncio.to_thread(self.flush)
+
+feedback_queue = FeedbackQueue()
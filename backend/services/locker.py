@@ -1,26 +1,138 @@
-import requests
-from bs4 import BeautifulSoup as bs
-import pandas as pd
+import asyncio
+import hashlib
 import json
 from collections import defaultdict, OrderedDict
 import re
 import copy
 
 from util.config import *
+from util.http_client import HttpClient
+from util.logger import Log, Color
+from util.metrics import time_stage, SOURCE_PAYLOAD_BYTES, SOURCE_UNCHANGED
 
-def getMRTLockerData():
+# lxml 為選用套件，沒有安裝時使用 bs4 + html.parser
+try:
+    import lxml.html
+    MRT_HTML_PARSER = "lxml"
+except ImportError:
+    MRT_HTML_PARSER = "html.parser"
+
+MRT_URL = "https://opendata.vip/metro/locker/station"
+TRA_URL = "https://lockerinfo.autosale.com.tw/lockerDatas"
+OWL_URL = "https://owlocker.com/api/info"
+METRO_LOCKER_URL = "https://web.metro.taipei/apis/metrostationapi/lockersinfoforrb"
+
+# 各來源上一次的回應：{source: {"etag", "last_modified", "digest", "result"}}
+_upstream_state = {}
+
+async def fetchUpstream(source, method, url, parse, in_thread=False, **kwargs):
+    """
+    爬取上游並解析；內容與上一次相同時直接沿用上次的解析結果。
+
+    GET 請求帶上 If-None-Match / If-Modified-Since（上游有提供 ETag / Last-Modified 時），回應 304 即不下載內容；
+    不支援條件式請求的上游則比對內容雜湊，完全相同時略過解析。
+    解析結果為唯讀（組成快照時不會修改），可以直接重複使用。
+    Args:
+        source: 來源名稱（用於指標與區分狀態）
+        method: HTTP 方法
+        url: 目標網址
+        parse: 解析函式，傳入 httpx.Response，回傳站點 list
+        in_thread: 是否在執行緒中解析（較耗 CPU 的 HTML 解析）
+        **kwargs: 傳給 HttpClient.request 的其他參數
+    """
+    previous = _upstream_state.get(source)
+    # POST 帶條件標頭的語意不同（可能回應 412），只對 GET 使用
+    if previous and method == "GET":
+        headers = dict(kwargs.pop("headers", None) or {})
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+        kwargs["headers"] = headers
+
+    with time_stage(source, "fetch"):
+        web = await HttpClient.request(method, url, **kwargs)
+    if web.status_code == 304 and previous:
+        SOURCE_UNCHANGED.labels(source, "not_modified").inc()
+        return previous["result"]
+
+    SOURCE_PAYLOAD_BYTES.labels(source).observe(len(web.content))
+    digest = hashlib.blake2b(web.content, digest_size=16).digest()
+    if previous and previous["digest"] == digest:
+        SOURCE_UNCHANGED.labels(source, "identical").inc()
+        result = previous["result"]
+    else:
+        with time_stage(source, "parse"):
+            result = await asyncio.to_thread(parse, web) if in_thread else parse(web)
+    _upstream_state[source] = {
+        "etag": web.headers.get("ETag"),
+        "last_modified": web.headers.get("Last-Modified"),
+        "digest": digest,
+        "result": result,
+    }
+    return result
+
+async def getMRTLockerData():
     """
     爬取 台北捷運 置物櫃資料
     並轉成 JSON 格式。
     """
-    url = "https://opendata.vip/metro/locker/station"
-    web = requests.get(url)
-    bs_web = bs(web.text, "html.parser")
+    # HTML 解析較耗 CPU，移到執行緒避免阻塞事件迴圈
+    return await fetchUpstream("MRT", "GET", MRT_URL, lambda web: parseMRTLockerData(web.text), in_thread=True)
+
+# XPath：class 含有指定名稱的元素（等同 CSS 的 .name）
+def _xpath_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+MRT_CARD_XPATH = "//div[normalize-space(@class)='lk-card lk-avail']"
+MRT_META_XPATH = f".//*[{_xpath_class('lk-card-meta')}]//*[{_xpath_class('lk-meta-tag')}]"
+
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+def _lxml_strings(element):
+    """依文件順序取出文字節點，略過註解與 script/style（與 bs4 行為一致）"""
+    if not isinstance(element.tag, str) or element.tag in NON_TEXT_TAGS:
+        return
+    if element.text:
+        yield element.text
+    for child in element:
+        yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+def _lxml_text(element):
+    """等同 bs4 的 get_text(strip=True)"""
+    return "".join(text.strip() for text in _lxml_strings(element) if text.strip())
+
+def _iterMRTCardsLxml(html):
+    """
+    以 lxml（C 實作）解析，只取出需要的欄位。
+    """
+    document = lxml.html.fromstring(html)
+    for card in document.xpath(MRT_CARD_XPATH):
+        meta = []
+        for tag in card.xpath(MRT_META_XPATH):
+            if tag not in meta:     # 巢狀時避免重複，與 CSS 選擇器結果一致
+                meta.append(tag)
+        yield {
+            "name": card.get("data-name").replace("(BR12)",""),
+            "desc": card.get("data-desc"),
+            "available": int(card.get("data-avail")),
+            "total": int(card.get("data-total")),
+            "meta": [_lxml_text(tag) for tag in meta],
+        }
+
+def _iterMRTCardsBs4(html):
+    """
+    以 bs4 + html.parser（純 Python）解析。
+    """
+    from bs4 import BeautifulSoup as bs     # 延遲載入，減少啟動時間
+
+    bs_web = bs(html, "html.parser")
     table = bs_web.find_all("div", class_="lk-card lk-avail")
 
-    lis = []
     for card in table:
-      data = {
+      yield {
           "name": card.get("data-name").replace("(BR12)",""),
           "line": card.get("data-line"),
           "desc": card.get("data-desc"),
@@ -35,6 +147,18 @@ def getMRTLockerData():
               for tag in card.select(".lk-card-meta .lk-meta-tag")
           ],
       }
+
+def parseMRTLockerData(html, parser=MRT_HTML_PARSER):
+    """
+    解析 台北捷運 置物櫃頁面 HTML。
+    Args:
+        html: 頁面內容
+        parser: "lxml"（預設，需安裝 lxml）或 "html.parser"，兩者輸出相同
+    """
+    cards = _iterMRTCardsLxml(html) if parser == "lxml" else _iterMRTCardsBs4(html)
+
+    lis = []
+    for data in cards:
       lis.append({
           "station": data["name"],
           "type": "MRT",
@@ -45,28 +169,34 @@ def getMRTLockerData():
           "empty": data["available"],
           "total": data["total"],
       })
-    df = pd.DataFrame(lis)
+    # 依 (station, type) 分組，並依站名排序
+    grouped = defaultdict(list)
+    for row in lis:
+        station, locker_type = row.pop("station"), row.pop("type")
+        grouped[(station, locker_type)].append(row)
 
-    # 分組整理
     result_json = []
-    for (station, locker_type), g in df.groupby(["station", "type"]):
+    for (station, locker_type), details in sorted(grouped.items()):
         result_json.append({
             "station": station,
             "type": locker_type,
             "tag": MRT_Mapping.get(station, []),
-            "details": g.drop(columns=["station", "type"]).to_dict(orient="records")
+            "details": details
         })
 
     return result_json
 
-def getTRALockerData():
+async def getTRALockerData():
   """
     爬取 台鐵 置物櫃資料（北部10站)
     並轉成 JSON 格式。
   """
-  url = "https://lockerinfo.autosale.com.tw/lockerDatas"
-  web_json = requests.get(url).json()
+  return await fetchUpstream("TRA", "GET", TRA_URL, lambda web: parseTRALockerData(web.json()))
 
+def parseTRALockerData(web_json):
+  """
+    解析 台鐵 lockerDatas 回應。
+  """
   # 初始化輸出資料結構
   result = defaultdict(lambda: {"station": "", "type": "TRA", "tag": [], "details": []})
   # 整理資料
@@ -96,7 +226,7 @@ def getTRALockerData():
               "empty": s_empty,
           })
       else:
-          print(f"⚠️ 找不到對應 lockerKey: {key}")
+          Log(f"找不到對應 lockerKey: {key}", color=Color.YELLOW)
 
   # 轉成 list 輸出
   output = list(result.values())
@@ -104,13 +234,17 @@ def getTRALockerData():
   # 印出結果（格式化 JSON）
   return output
 
-def getOWLockerData():
+async def getOWLockerData():
   """
     爬取 OWLocker 置物櫃資料
     並轉成 JSON 格式。
   """
-  url = "https://owlocker.com/api/info"
-  web_json = requests.get(url).json()
+  return await fetchUpstream("OWL", "GET", OWL_URL, lambda web: parseOWLockerData(web.json()))
+
+def parseOWLockerData(web_json):
+  """
+    解析 OWLocker api/info 回應。
+  """
   result = []
   for item in web_json:
     station = item['co_unit_i18n']['zh-TW'].strip()
@@ -142,15 +276,20 @@ def getOWLockerData():
         })
   return merge_station_details(result)
 
-def getArenaLockerData():
+async def getArenaLockerData():
     """
     爬取 台北小巨蛋 置物櫃資料
     並轉成 JSON 格式。
     """
-    url = "https://web.metro.taipei/apis/metrostationapi/lockersinfoforrb"
-    body = {"Field": "arena", "Lang": "TW"}
-    web_json = requests.post(url, json=body).json()
-    
+    return await fetchUpstream(
+        "Arena", "POST", METRO_LOCKER_URL, lambda web: parseArenaLockerData(web.json()),
+        json={"Field": "arena", "Lang": "TW"},
+    )
+
+def parseArenaLockerData(web_json):
+    """
+    解析 台北小巨蛋 lockersinfoforrb 回應。
+    """
     details = []
     for location in web_json:
         loc = location["PositionTW"].replace(" *供冰上樂園入場遊客使用", "")
@@ -196,15 +335,20 @@ def getArenaLockerData():
     
     return result
 
-def getTcapLockerData():
+async def getTcapLockerData():
     """
     爬取 兒童新樂園 置物櫃資料
     並轉成 JSON 格式。
     """
-    url = "https://web.metro.taipei/apis/metrostationapi/lockersinfoforrb"
-    body = {"Field": "tcap", "Lang": "TW"}
-    web_json = requests.post(url, json=body).json()
-    
+    return await fetchUpstream(
+        "Tcap", "POST", METRO_LOCKER_URL, lambda web: parseTcapLockerData(web.json()),
+        json={"Field": "tcap", "Lang": "TW"},
+    )
+
+def parseTcapLockerData(web_json):
+    """
+    解析 兒童新樂園 lockersinfoforrb 回應。
+    """
     details = []
     for location in web_json:
         loc = location["PositionTW"]
@@ -334,13 +478,18 @@ def getKRTCLockerData():
 
 
 if __name__ == "__main__":
-    with open("MRTLocker.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(getMRTLockerData(), ensure_ascii=False, indent=2))
-    with open("TRALocker.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(getTRALockerData(), ensure_ascii=False, indent=2))
-    with open("OWLocker.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(getOWLockerData(), ensure_ascii=False, indent=2))
-    with open("ArenaLocker.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(getArenaLockerData(), ensure_ascii=False, indent=2))
-    with open("TcapLocker.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(getTcapLockerData(), ensure_ascii=False, indent=2))
+    async def main():
+        scrapers = {
+            "MRTLocker.json": getMRTLockerData,
+            "TRALocker.json": getTRALockerData,
+            "OWLocker.json": getOWLockerData,
+            "ArenaLocker.json": getArenaLockerData,
+            "TcapLocker.json": getTcapLockerData,
+        }
+        results = await asyncio.gather(*(fetch() for fetch in scrapers.values()))
+        await HttpClient.close()
+        for filename, data in zip(scrapers, results):
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False, indent=2))
+
+    asyncio.run(main())
@@ -0,0 +1,359 @@
+import asyncio
+import inspect
+import os
+import time
+from collections import deque
+
+from services.locker import *
+from services.locker_snapshot import LockerSnapshot, diff_details, format_changes
+from services.locker_stream import locker_broadcaster
+from services.snapshot_store import FileSnapshotStore, create_snapshot_store, encode_snapshot, decode_snapshot
+from util.env import Env
+from util.logger import Log, Color
+from util.metrics import SOURCE_REFRESHES, SOURCE_LAST_SUCCESS, SNAPSHOT_VERSION, SNAPSHOT_PUBLISHES
+
+REFRESH_LEAD = 5        # 提前於 TTL 到期前幾秒重新爬取
+CHANGE_HISTORY = 120    # 保留最近幾個版本的差異
+FOLLOW_INTERVAL = 1     # 非 leader 的 worker 檢查新快照的間隔（秒）
+STORE_FAILOVER = 30     # 共用快照後端無法連線超過此秒數時，改為自行爬取
+
+
+class LockerSource:
+    """
+    置物櫃資料來源設定
+
+    Args:
+        name (str): 來源名稱，同時作為 /Locker?type= 的篩選鍵。
+        fetch (callable): 爬取函式（async 或一般函式），回傳站點 list。
+        ttl (int): 資料有效時間（秒）。
+        timeout (int): 單次更新的總逾時（秒，含重試）。
+        keep_last_good (bool): 爬取失敗時是否保留上一次成功的資料。
+        static (bool): 靜態資料，只在啟動時計算一次。
+    """
+
+    def __init__(self, name, fetch, ttl=30, timeout=15, keep_last_good=True, static=False):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.timeout = timeout
+        self.keep_last_good = keep_last_good
+        self.static = static
+
+
+# 資料來源註冊表（順序即為合併輸出的順序）
+LOCKER_SOURCES = [
+    LockerSource("MRT", getMRTLockerData, ttl=30, timeout=20),
+    LockerSource("TRA", getTRALockerData, ttl=30, timeout=15),
+    LockerSource("OWL", getOWLockerData, ttl=30, timeout=15),
+    LockerSource("Arena", getArenaLockerData, ttl=60, timeout=15),
+    LockerSource("Tcap", getTcapLockerData, ttl=60, timeout=15),
+    LockerSource("KRTC", getKRTCLockerData, static=True),  # hardcode 資料，不需重複計算
+]
+
+
+class LockerCache:
+    """
+    置物櫃資料快取（單例模式）
+
+    每個來源由各自的背景任務依照自己的 TTL 更新，失敗互不影響；
+    任一來源更新後即組成新的快照（含預先序列化的回應）一次性替換，
+    API 請求只讀取記憶體中的快照，不會等待爬蟲。
+
+    多個 worker / replica 時只有 leader 爬取上游並發布快照（共用方式見 services/snapshot_store.py），
+    其他 worker 讀取共用的快照並在本地重建檢視與差異；leader 結束時由其他 worker 接手。
+    """
+
+    _instance = None
+
+    def __new__(cls, sources=LOCKER_SOURCES):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._sources = {source.name: source for source in sources}
+            cls._instance._results = {}         # 各來源最新資料：{name: list}
+            cls._instance._fetched_at = {}      # 各來源最後成功更新時間：{name: timestamp}
+            cls._instance._snapshot = LockerSnapshot({}, 0)    # 以單一參照存放確保替換為原子操作
+            cls._instance._publish_lock = asyncio.Lock()
+            cls._instance._changes = deque(maxlen=CHANGE_HISTORY)     # [(舊版本, 新版本, 差異), ...]
+            cls._instance._tasks = []
+            cls._instance._store = create_snapshot_store()
+            # 最後一份快照保存在本機，重新啟動時先以此回應（file 後端本身即為本機檔案）
+            store = cls._instance._store
+            cls._instance._persist = store if isinstance(store, FileSnapshotStore) else FileSnapshotStore(Env.SNAPSHOT_PATH)
+        return cls._instance
+
+    def snapshot(self) -> LockerSnapshot:
+        """取得目前快照"""
+        return self._snapshot
+
+    def is_ready(self) -> bool:
+        """是否已有可回應的快照（上次保存的快照、共用快照或第一次爬取完成）"""
+        return self._snapshot.version > 0
+
+    def age(self) -> float:
+        """
+        距離最後一次成功爬取的秒數
+        資料沒有變動時不會重建快照，因此以各來源最後成功爬取的時間計算，而不是快照建立的時間
+        """
+        verified_at = max(self._fetched_at.values(), default=0) or self._snapshot.fetch_time
+        return max(0.0, time.time() - verified_at) if verified_at else 0.0
+
+    def changes_since(self, version: int):
+        """
+        取得指定版本之後的櫃位差異
+        Returns:
+            dict | None: {detail_key: detail 或 None（已移除）}；版本過舊或無法比對時回傳 None
+        """
+        current = self._snapshot.version
+        if version == current:
+            return {}
+        if version > current:
+            return None
+
+        merged = {}
+        expected = version
+        for from_version, to_version, changes in list(self._changes):
+            if to_version <= version:
+                continue
+            if from_version != expected:    # 版本已不在保留範圍內
+                return None
+            merged.update(changes)
+            expected = to_version
+        return merged if expected == current else None
+
+    def _build(self, data: dict, fetch_time: float, version: int) -> tuple:
+        """建立新快照、與前一版比對差異，並轉為共用內容（在執行緒中執行）"""
+        snapshot = LockerSnapshot(data, fetch_time, version)
+        payload = encode_snapshot(snapshot, dict(self._fetched_at))
+        return snapshot, diff_details(self._snapshot.details, snapshot.details), payload
+
+    def _load(self, payload: bytes) -> tuple:
+        """由共用內容重建快照並與前一版比對差異（在執行緒中執行）"""
+        snapshot, fetched_at = decode_snapshot(payload)
+        return snapshot, diff_details(self._snapshot.details, snapshot.details), fetched_at
+
+    def _merge_fetched_at(self, fetched_at: dict):
+        """合併共用的爬取時間（快照內與 touch() 更新的時間可能先後到達，各來源取較新者）"""
+        for name, timestamp in fetched_at.items():
+            if timestamp > self._fetched_at.get(name, 0):
+                self._fetched_at[name] = timestamp
+
+    def _install(self, snapshot: LockerSnapshot, changes: dict):
+        """替換目前快照並記錄差異（需持有 _publish_lock）"""
+        self._changes.append((self._snapshot.version, snapshot.version, changes))
+        self._snapshot = snapshot
+        SNAPSHOT_VERSION.set(snapshot.version)
+        SNAPSHOT_PUBLISHES.inc()
+        # 有變動時推播給所有訂閱者（每次更新只序列化一次）
+        if changes and len(locker_broadcaster):
+            locker_broadcaster.publish(snapshot.version, *format_changes(changes))
+
+    async def _publish(self):
+        """依註冊順序組成新的快照並替換（序列化、壓縮與比對在執行緒中進行），再發布給其他 worker"""
+        async with self._publish_lock:
+            data = {name: self._results.get(name, []) for name in self._sources}
+            # 以毫秒時間作為版本基準，重新啟動後版本仍然遞增
+            version = max(self._snapshot.version + 1, int(time.time() * 1000))
+            snapshot, changes, payload = await asyncio.to_thread(self._build, data, time.time(), version)
+            self._install(snapshot, changes)
+        try:
+            await asyncio.to_thread(self._store.publish, version, payload)
+        except Exception as e:
+            Log(f"寫入共用快照失敗: {e}", color=Color.RED)
+        if self._persist is not self._store:
+            try:
+                await asyncio.to_thread(self._persist.publish, version, payload)
+            except Exception as e:
+                Log(f"保存快照失敗: {e}", color=Color.RED)
+
+    async def _touch(self):
+        """快照內容沒有變動時，只將各來源的爬取時間寫入共用後端與本機（不重新序列化、不增加版本）"""
+        fetched_at = dict(self._fetched_at)
+        try:
+            await asyncio.to_thread(self._store.touch, fetched_at)
+        except Exception as e:
+            Log(f"更新共用快照的爬取時間失敗: {e}", color=Color.RED)
+        if self._persist is not self._store:
+            try:
+                await asyncio.to_thread(self._persist.touch, fetched_at)
+            except Exception as e:
+                Log(f"保存爬取時間失敗: {e}", color=Color.RED)
+
+    async def refresh_gps(self):
+        """站點座標載入後重新組成快照，不必等到下一次爬取（只有 leader 需要）"""
+        if self._store.is_leader and self._results and self.is_ready():
+            await self._publish()
+
+    async def _sync_from_store(self):
+        """讀取 leader 發布的新快照"""
+        payload = await asyncio.to_thread(self._store.read, self._snapshot.version)
+        if payload is not None:
+            async with self._publish_lock:
+                snapshot, changes, fetched_at = await asyncio.to_thread(self._load, payload)
+                if snapshot.version > self._snapshot.version:
+                    self._install(snapshot, changes)
+                    self._merge_fetched_at(fetched_at)
+        # 資料沒有變動時 leader 只更新爬取時間
+        fetched_at = await asyncio.to_thread(self._store.read_fetched_at)
+        if fetched_at:
+            self._merge_fetched_at(fetched_at)
+
+    async def refresh_source(self, source: LockerSource) -> bool:
+        """
+        更新單一來源。
+        Returns:
+            bool: 資料是否有變動（上游內容未變動、或爬取失敗沿用上次資料時為 False）
+        """
+        previous = self._results.get(source.name)
+        try:
+            if inspect.iscoroutinefunction(source.fetch):
+                result = await asyncio.wait_for(source.fetch(), timeout=source.timeout)
+            else:
+                result = source.fetch()
+        except Exception as e:
+            reason = "逾時" if isinstance(e, asyncio.TimeoutError) else e
+            if source.keep_last_good and source.name in self._results:
+                Log(f"爬取 {source.name} 失敗: {reason}，沿用上次資料", color=Color.YELLOW)
+                SOURCE_REFRESHES.labels(source.name, "stale").inc()
+                return False
+            Log(f"爬取 {source.name} 失敗: {reason}", color=Color.RED)
+            SOURCE_REFRESHES.labels(source.name, "error").inc()
+            self._results[source.name] = []
+            return previous != []
+
+        self._results[source.name] = result
+        self._fetched_at[source.name] = time.time()
+        SOURCE_REFRESHES.labels(source.name, "ok").inc()
+        SOURCE_LAST_SUCCESS.labels(source.name).set(self._fetched_at[source.name])
+        # 上游內容未變動時爬蟲直接回傳上次的解析結果（同一個物件）
+        return result is not previous
+
+    async def _refresh_loop(self, source: LockerSource):
+        """單一來源的背景更新迴圈：在資料過期前重新爬取，資料有變動時才發布新快照"""
+        interval = max(source.ttl - REFRESH_LEAD, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                fetched_at = self._fetched_at.get(source.name)
+                changed = await self.refresh_source(source)
+                # 資料沒有變動、也沒有新查到的座標時沿用目前快照（不重新序列化、不增加版本、不寫入共用快照），
+                # 只共用爬取時間，讓其他 worker 與重新啟動後的資料時間正確
+                if changed or self._snapshot.gps_resolved():
+                    await self._publish()
+                elif self._fetched_at.get(source.name) != fetched_at:
+                    await self._touch()
+            except Exception as e:
+                Log(f"背景更新 {source.name} 失敗: {e}", color=Color.RED)
+
+    async def _restore(self) -> bool:
+        """
+        載入本機保存的最後一份快照（已含座標），重新啟動後不必等待爬蟲即可回應
+        Returns:
+            bool: 是否成功載入
+        """
+        try:
+            payload = await asyncio.to_thread(self._persist.read)
+            if payload is None:
+                return False
+            async with self._publish_lock:
+                snapshot, changes, fetched_at = await asyncio.to_thread(self._load, payload)
+                self._install(snapshot, changes)
+                self._merge_fetched_at(fetched_at)
+            fetched_at = await asyncio.to_thread(self._persist.read_fetched_at)
+            if fetched_at:
+                self._merge_fetched_at(fetched_at)
+        except Exception as e:
+            Log(f"載入上次的快照失敗: {e}", color=Color.YELLOW)
+            return False
+        Log(f"已載入上次的置物櫃資料（{self.age():.0f} 秒前）", color=Color.GREEN)
+        return True
+
+    async def _lead(self):
+        """成為 leader：先並行建立所有來源的第一份資料，再為非靜態來源啟動背景更新任務"""
+        Log(f"Worker {os.getpid()} 負責更新置物櫃資料", color=Color.GREEN)
+        # 由 follower 接手時沿用目前快照，爬取失敗的來源仍有上次資料
+        for name, stations in self._snapshot.data.items():
+            self._results.setdefault(name, stations)
+        await asyncio.gather(*(self.refresh_source(source) for source in self._sources.values()))
+        await self._publish()
+        self._tasks += [
+            asyncio.create_task(self._refresh_loop(source))
+            for source in self._sources.values()
+            if not source.static
+        ]
+        if self._store.renew_interval:
+            self._tasks.append(asyncio.create_task(self._renew_loop()))
+
+    async def _renew_loop(self):
+        """leader 定期續約；租約已被其他 replica 取得時停止爬取，改為讀取共用快照"""
+        while True:
+            await asyncio.sleep(self._store.renew_interval)
+            try:
+                if await asyncio.to_thread(self._store.try_acquire):
+                    continue
+            except Exception as e:
+                # 共用後端暫時無法連線時繼續自行爬取，恢復後再確認 leader 身分
+                Log(f"leader 續約失敗: {e}", color=Color.YELLOW)
+                continue
+            Log(f"Worker {os.getpid()} 已不是 leader，改為使用共用的置物櫃資料", color=Color.YELLOW)
+            current = asyncio.current_task()
+            tasks = [task for task in self._tasks if task is not current]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks = [asyncio.create_task(self._follow_loop())]
+            return
+
+    async def _follow_loop(self):
+        """非 leader 的背景任務：定期讀取新快照，leader 結束時接手；共用後端長時間無法連線時改為自行爬取"""
+        failed_since = None
+        while True:
+            await asyncio.sleep(FOLLOW_INTERVAL)
+            try:
+                if await asyncio.to_thread(self._store.try_acquire):
+                    await self._lead()
+                    return
+                await self._sync_from_store()
+                failed_since = None
+            except Exception as e:
+                if failed_since is None:
+                    failed_since = time.monotonic()
+                    Log(f"同步共用快照失敗: {e}", color=Color.RED)
+                elif time.monotonic() - failed_since > STORE_FAILOVER:
+                    Log(f"共用快照超過 {STORE_FAILOVER} 秒無法同步，改為自行爬取", color=Color.YELLOW)
+                    await self._lead()
+                    return
+
+    async def start(self):
+        """
+        取得 leader 身分的 worker 開始爬取，其他 worker 讀取共用快照。
+        有保存的快照時先以其回應；第一次爬取一律在背景進行，不延遲啟動（完成與否見 is_ready()）。
+        """
+        await self._restore()
+        try:
+            leader = await asyncio.to_thread(self._store.try_acquire)
+        except Exception as e:
+            Log(f"無法連線共用快照後端: {e}，改為自行爬取", color=Color.YELLOW)
+            leader = True
+        if leader:
+            self._tasks.append(asyncio.create_task(self._lead()))
+        else:
+            Log(f"Worker {os.getpid()} 使用共用的置物櫃資料", color=Color.BLUE)
+            try:
+                await self._sync_from_store()
+            except Exception as e:
+                # 讀取或解析失敗時不中斷啟動，由 _follow_loop 重試並在必要時改為自行爬取
+                Log(f"同步共用快照失敗: {e}", color=Color.RED)
+            self._tasks.append(asyncio.create_task(self._follow_loop()))
+
+    async def stop(self):
+        """停止所有背景任務並釋放 leader 身分"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await asyncio.to_thread(self._store.release)
+        except Exception as e:
+            Log(f"釋放 leader 身分失敗: {e}", color=Color.YELLOW)
+
+locker_cache = LockerCache()
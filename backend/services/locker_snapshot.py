@@ -0,0 +1,222 @@
+import gzip
+import hashlib
+import json
+from itertools import chain
+from email.utils import formatdate
+
+# brotli 為選用套件，沒有安裝時只提供 gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from services.spatial_index import StationGridIndex
+from util.config import StationGPSManager
+
+ALL_VIEW = "all"    # 未指定 type 時的合併檢視
+TAIPEI_TRA_GPS = {"lat": 25.047784479915663, "lng": 121.51642612598873}  # 台鐵台北車站固定座標
+
+
+class RenderedView:
+    """
+    預先序列化完成的回應內容
+
+    每份快照只產生一次 JSON bytes 與壓縮版本，請求時直接回傳。
+    """
+
+    def __init__(self, content):
+        # 與 FastAPI JSONResponse 相同的序列化格式
+        self.body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        # 各壓縮版本內容相同，使用弱 ETag
+        self.etag = f'W/"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+        self.encodings = {"gzip": gzip.compress(self.body, compresslevel=6)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(self.body, quality=5)
+
+    def negotiate(self, accept_encoding: str) -> tuple:
+        """
+        依 Accept-Encoding 選擇回應內容。
+        Returns:
+            tuple: (內容 bytes, Content-Encoding 或 None)
+        """
+        accepted = set()
+        for item in (accept_encoding or "").split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+
+        for coding in ("br", "gzip"):
+            if coding in accepted and coding in self.encodings:
+                return self.encodings[coding], coding
+        return self.body, None
+
+    def matches(self, if_none_match: str) -> bool:
+        """If-None-Match 是否符合目前 ETag（弱比對）"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        current = self.etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == current for tag in if_none_match.split(","))
+
+
+def build_all_view(data: dict, gps: dict = None, pending: set = None) -> tuple:
+    """
+    合併所有來源並加上站點座標。
+
+    只取一次座標字典，逐站建立新的 dict，不修改快取中的原始資料。
+    未知站點排入背景查詢，先以 (0, 0) 並標記 gps_pending 回傳。
+    從其他 worker 取得的快照會一併傳入 gps 與 pending，直接使用而不另外查詢。
+    Returns:
+        tuple: 合併後的站點（唯讀）
+    """
+    lookup = gps is None
+    stationData = StationGPSManager.get_station_GPS_dict() if lookup else gps
+    merged = []
+    for station in chain.from_iterable(data.values()):
+        name = station["station"]
+        if name == "台北車站" and station["type"] == "TRA":
+            location = TAIPEI_TRA_GPS
+        else:
+            location = stationData.get(name) or (StationGPSManager.request_gps(name) if lookup else None)
+        item = {
+            **station,
+            "lat": location["lat"] if location else 0,
+            "lng": location["lng"] if location else 0,
+        }
+        if not location and (StationGPSManager.is_pending(name) if lookup else name in pending):
+            item["gps_pending"] = True
+        merged.append(item)
+    return tuple(merged)
+
+
+def detail_key(source: str, station: dict, detail: dict) -> tuple:
+    """櫃位的唯一鍵：(來源, 站點, id, 尺寸, 位置)；部分來源 id 重複，因此加上位置區分"""
+    return (source, station["station"], detail["id"], detail["size"], detail["loc"])
+
+
+def index_details(data: dict) -> dict:
+    """建立 {detail_key: detail} 對照表，用於比對版本差異"""
+    return {
+        detail_key(source, station, detail): detail
+        for source, stations in data.items()
+        for station in stations
+        for detail in station["details"]
+    }
+
+
+def diff_details(old: dict, new: dict) -> dict:
+    """
+    比對兩份櫃位對照表
+    Returns:
+        dict: {detail_key: 新的 detail，已移除則為 None}
+    """
+    changes = {key: detail for key, detail in new.items() if old.get(key) != detail}
+    changes.update((key, None) for key in old.keys() - new.keys())
+    return changes
+
+
+def format_changes(changes: dict) -> tuple:
+    """
+    將差異轉成 API 輸出格式
+    Returns:
+        tuple: (有變動的櫃位 list, 已移除的櫃位 list)
+    """
+    changed, removed = [], []
+    for (source, station, id, size, loc), detail in changes.items():
+        key = {"source": source, "station": station, "id": id, "size": size, "loc": loc}
+        if detail is None:
+            removed.append(key)
+        else:
+            changed.append({**key, "empty": detail["empty"], "total": detail["total"], "price": detail["price"]})
+    return changed, removed
+
+
+class LockerSnapshot:
+    """
+    置物櫃資料快照
+
+    建立時即完成各來源與合併檢視的序列化，建立後不再修改，
+    可在多個執行緒間共用而不需加鎖。
+    """
+
+    def __init__(self, data: dict, fetch_time: float, version: int = 0, gps: dict = None, pending: set = None):
+        self.data = data                # 各來源資料：{name: list}
+        self.fetch_time = fetch_time
+        self.version = version          # 單調遞增的快照版本
+        self.last_modified = formatdate(fetch_time, usegmt=True)
+        self.views = {name: RenderedView(stations) for name, stations in data.items()}
+        self.stations = build_all_view(data, gps, pending or set())    # 合併檢視（含座標）
+        self.views[ALL_VIEW] = RenderedView(self.stations)
+        # 每個站點所屬的來源名稱，與 stations 位置對應
+        self.station_sources = tuple(chain.from_iterable([name] * len(stations) for name, stations in data.items()))
+        self.index = StationGridIndex([(station["lat"], station["lng"]) for station in self.stations])
+        self.details = index_details(data)
+        self.pending_gps = frozenset(station["station"] for station in self.stations if station.get("gps_pending"))
+
+    def station_gps(self) -> tuple:
+        """
+        取得快照中各站點使用的座標，供其他 worker 重建相同的合併檢視
+        Returns:
+            tuple: ({站點: {"lat", "lng"}}, [等待查詢中的站點])
+        """
+        stationData = StationGPSManager.get_station_GPS_dict()
+        names = {station["station"] for stations in self.data.values() for station in stations}
+        gps = {name: stationData[name] for name in names if name in stationData}
+        return gps, sorted(self.pending_gps)
+
+    def gps_resolved(self) -> bool:
+        """是否有等待查詢座標的站點已查詢完成（重新組成快照即可帶入座標）"""
+        return any(not StationGPSManager.is_pending(name) for name in self.pending_gps)
+
+    def view(self, type: str = None) -> RenderedView:
+        """取得指定來源的檢視，找不到時回傳合併檢視"""
+        return self.views.get(type) or self.views[ALL_VIEW]
+
+    def search(self, type=None, bbox=None, near=None, radius=None, k=None, size=None, min_empty=None) -> list:
+        """
+        依條件篩選站點（使用空間索引）
+        Args:
+            type: 來源名稱，不存在時不篩選
+            bbox: (min_lat, min_lng, max_lat, max_lng)
+            near: (lat, lng)，結果依距離排序並加上 distance（公尺）
+            radius: near 的最大距離（公尺）
+            k: near 的最多筆數
+            size: 只保留指定尺寸（S/M/L）的櫃位
+            min_empty: 只保留空櫃數至少為此值的櫃位
+        Returns:
+            list: 篩選後的站點（新的 dict，不修改快照）
+        """
+        if near is not None:
+            candidates = self.index.nearest(near[0], near[1], radius=radius, k=None if self._has_detail_filter(type, bbox, size, min_empty) else k)
+        elif bbox is not None:
+            candidates = [(None, i) for i in self.index.bbox(*bbox)]
+        else:
+            candidates = [(None, i) for i in range(len(self.stations))]
+
+        result = []
+        for distance, i in candidates:
+            if type in self.data and self.station_sources[i] != type:
+                continue
+            station = self.stations[i]
+            if bbox is not None and not (bbox[0] <= station["lat"] <= bbox[2] and bbox[1] <= station["lng"] <= bbox[3]):
+                continue
+            details = [
+                detail for detail in station["details"]
+                if (size is None or detail["size"] == size)
+                and (min_empty is None or (detail["empty"] is not None and detail["empty"] >= min_empty))
+            ]
+            if not details:
+                continue
+            item = {**station, "details": details}
+            if distance is not None:
+                item["distance"] = round(distance)
+            result.append(item)
+            if k is not None and near is not None and len(result) >= k:
+                break
+        return result
+
+    def _has_detail_filter(self, type, bbox, size, min_empty) -> bool:
+        """是否有會剔除站點的條件（此時最近站點查詢不能只取前 k 筆，篩選後才取 k 筆）"""
+        return type in self.data or bbox is not None or size is not None or min_empty is not None
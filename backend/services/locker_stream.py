@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from util.logger import Log, Color
+
+
+def format_sse(event: str, data: dict, id: int = None) -> bytes:
+    """組成一則 Server-Sent Events 訊息"""
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class LockerBroadcaster:
+    """
+    置物櫃更新推播（單例模式）
+
+    每次快照更新只序列化一次事件，再分送給所有訂閱者。
+    每個訂閱者的佇列有上限，消化太慢時清空佇列並改送 resync 事件，
+    請客戶端自行以 /Locker/changes 補齊，伺服器不會因此累積資料。
+    """
+
+    QUEUE_SIZE = 8          # 每個訂閱者最多暫存的事件數
+    MAX_SUBSCRIBERS = 1000  # 最多同時連線數
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._subscribers = set()
+        return cls._instance
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def is_full(self) -> bool:
+        """連線數是否已達上限"""
+        return len(self._subscribers) >= self.MAX_SUBSCRIBERS
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        新增訂閱者
+        Returns:
+            asyncio.Queue: 事件佇列；連線數已滿時回傳 None
+        """
+        if self.is_full():
+            return None
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        """移除訂閱者"""
+        self._subscribers.discard(queue)
+
+    def publish(self, version: int, changes: list, removed: list):
+        """推播一次快照更新（需在事件迴圈中呼叫）"""
+        if not self._subscribers:
+            return
+        message = format_sse("changes", {"version": version, "changes": changes, "removed": removed}, id=version)
+        resync = None
+        for queue in self._subscribers:
+            if queue.full():
+                # 慢速客戶端：丟棄積壓的事件，改通知重新同步
+                while not queue.empty():
+                    queue.get_nowait()
+                resync = resync or format_sse("resync", {"version": version}, id=version)
+                queue.put_nowait(resync)
+                Log("推播佇列已滿，要求客戶端重新同步", color=Color.YELLOW, reload_only=True)
+            else:
+                queue.put_nowait(message)
+
+locker_broadcaster = LockerBroadcaster()
@@ -0,0 +1,344 @@
+import json
+import mmap
+import os
+import socket
+import struct
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+# fcntl 只有 Unix 提供；沒有時（例如 Windows 開發環境）視為單一 worker，永遠是 leader
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# redis 為選用套件，只有 SNAPSHOT_BACKEND=redis 時需要
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from services.locker_snapshot import LockerSnapshot
+from util.env import Env
+from util.logger import Log, Color
+
+MAGIC = b"LKS1"
+HEADER = struct.Struct("<4sQQ")     # (MAGIC, 快照版本, 內容長度)
+
+
+def encode_snapshot(snapshot: LockerSnapshot, fetched_at: dict) -> bytes:
+    """將快照轉為跨 worker 共用的內容（各來源原始資料與合併時使用的座標）"""
+    gps, pending = snapshot.station_gps()
+    return json.dumps({
+        "version": snapshot.version,
+        "fetch_time": snapshot.fetch_time,
+        "fetched_at": fetched_at,
+        "data": snapshot.data,
+        "gps": gps,
+        "pending": pending,
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_snapshot(payload: bytes) -> tuple:
+    """
+    由共用內容重建快照（預先序列化、壓縮與空間索引都在這裡完成）
+    Returns:
+        tuple: (LockerSnapshot, 各來源最後成功更新時間)
+    """
+    content = json.loads(payload)
+    snapshot = LockerSnapshot(
+        content["data"],
+        content["fetch_time"],
+        content["version"],
+        gps=content["gps"],
+        pending=set(content["pending"]),
+    )
+    return snapshot, content["fetched_at"]
+
+
+class SnapshotStore(ABC):
+    """
+    快照共用後端的介面
+
+    - try_acquire()：嘗試成為 leader（只有 leader 爬取上游），已是 leader 時續約
+    - publish()：leader 發布新快照
+    - read()：其他 worker / replica 讀取較新的快照
+    - touch()：快照內容沒有變動時，leader 只更新各來源最後成功爬取的時間（不重新發布快照）
+    - read_fetched_at()：讀取 touch() 更新的爬取時間
+    - release()：釋放 leader 身分
+
+    renew_interval 不為 None 時，leader 需定期呼叫 try_acquire() 續約，回傳 False 表示已失去 leader 身分。
+    所有方法都可能進行 I/O，應在執行緒中呼叫。
+    """
+
+    renew_interval = None
+
+    @property
+    @abstractmethod
+    def is_leader(self) -> bool:
+        ...
+
+    @abstractmethod
+    def try_acquire(self) -> bool:
+        ...
+
+    @abstractmethod
+    def publish(self, version: int, payload: bytes):
+        ...
+
+    @abstractmethod
+    def read(self, known_version: int = -1):
+        ...
+
+    @abstractmethod
+    def touch(self, fetched_at: dict):
+        ...
+
+    @abstractmethod
+    def read_fetched_at(self):
+        ...
+
+    @abstractmethod
+    def release(self):
+        ...
+
+
+class MemorySnapshotStore(SnapshotStore):
+    """只在程序內使用快照（單一 worker），永遠是 leader，不對外發布"""
+
+    @property
+    def is_leader(self) -> bool:
+        return True
+
+    def try_acquire(self) -> bool:
+        return True
+
+    def publish(self, version: int, payload: bytes):
+        pass
+
+    def read(self, known_version: int = -1):
+        return None
+
+    def touch(self, fetched_at: dict):
+        pass
+
+    def read_fetched_at(self):
+        return None
+
+    def release(self):
+        pass
+
+
+class FileSnapshotStore(SnapshotStore):
+    """
+    以本機檔案在多個 worker 間共用快照
+
+    - 以 flock 檔案鎖選出 leader：只有取得鎖的 worker 爬取上游；
+      leader 結束時作業系統會釋放鎖，由其他 worker 接手。
+    - leader 每次發布時寫入暫存檔再以 os.replace 替換，讀取端不會看到寫到一半的內容。
+    - 其他 worker 只比對檔案的 inode 與修改時間，有變動時才以 mmap 讀取。
+    - 快照內容沒有變動時，各來源的爬取時間另外寫入同路徑加上 .fetched 的小檔案。
+
+    Args:
+        path (str): 快照檔路徑，鎖定檔為同路徑加上 .lock。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._fetched_path = self.path.with_name(self.path.name + ".fetched")
+        self._lock_file = None
+        self._seen = None   # 上次讀取時的 (inode, 修改時間, 大小)
+        self._fetched_seen = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+
+    def try_acquire(self) -> bool:
+        """嘗試成為 leader（不阻塞）"""
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            self._lock_file = True
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.path.with_name(self.path.name + ".lock"), "a+b")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def publish(self, version: int, payload: bytes):
+        """寫入新的快照（只由 leader 呼叫）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, version, len(payload)))
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def read(self, known_version: int = -1):
+        """
+        讀取比 known_version 更新的快照
+        Returns:
+            bytes | None: 快照內容；沒有檔案或沒有更新時回傳 None
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        seen = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if seen == self._seen or stat.st_size < HEADER.size:
+            return None
+        try:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, version, length = HEADER.unpack_from(mapped)
+                if magic != MAGIC or HEADER.size + length > len(mapped):
+                    Log("快照檔格式不符，略過", color=Color.YELLOW)
+                    return None
+                self._seen = seen
+                if version <= known_version:
+                    return None
+                return mapped[HEADER.size:HEADER.size + length]
+        except (OSError, ValueError) as e:
+            Log(f"讀取快照檔失敗：{e}", color=Color.RED)
+            return None
+
+    def touch(self, fetched_at: dict):
+        """更新各來源最後成功爬取的時間（只由 leader 呼叫）"""
+        self._fetched_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._fetched_path.with_name(self._fetched_path.name + f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(fetched_at), encoding="utf-8")
+        os.replace(tmp_path, self._fetched_path)
+
+    def read_fetched_at(self):
+        """
+        讀取 touch() 寫入的爬取時間
+        Returns:
+            dict | None: {name: timestamp}；沒有檔案或沒有更新時回傳 None
+        """
+        try:
+            stat = os.stat(self._fetched_path)
+            seen = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if seen == self._fetched_seen:
+                return None
+            fetched_at = json.loads(self._fetched_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            Log(f"讀取爬取時間失敗：{e}", color=Color.RED)
+            return None
+        self._fetched_seen = seen
+        return fetched_at
+
+    def release(self):
+        """釋放 leader 身分"""
+        if self._lock_file not in (None, True):
+            self._lock_file.close()
+        self._lock_file = None
+
+
+class RedisSnapshotStore(SnapshotStore):
+    """
+    以 Redis（或相容協定的服務）在多個 replica 間共用快照
+
+    - leader 以 SET NX PX 取得有期限的租約，並定期續約；程序中止或斷線時租約到期，由其他 replica 接手。
+    - 快照內容與版本分別存放，其他 replica 每次只讀取版本號，有更新時才讀取內容。
+    - 快照內容沒有變動時，各來源的爬取時間另外存放在一個小 key。
+
+    Args:
+        url (str): Redis 連線網址，例如 redis://localhost:6379/0。
+        prefix (str): key 前綴，同一組 replica 需使用相同前綴。
+        lease (float): leader 租約秒數。
+    """
+
+    def __init__(self, url: str, prefix: str = "lockermaps", lease: float = 15):
+        if redis is None:
+            raise RuntimeError("SNAPSHOT_BACKEND=redis 需要安裝 redis 套件")
+        self._client = redis.Redis.from_url(url, socket_timeout=5)
+        self._leader_key = f"{prefix}:leader"
+        self._version_key = f"{prefix}:snapshot:version"
+        self._payload_key = f"{prefix}:snapshot:payload"
+        self._fetched_key = f"{prefix}:snapshot:fetched_at"
+        self._fetched_seen = None
+        self._id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_ms = int(lease * 1000)
+        self.renew_interval = lease / 3
+        self._leader = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def try_acquire(self) -> bool:
+        if not self._leader:
+            self._leader = bool(self._client.set(self._leader_key, self._id, nx=True, px=self._lease_ms))
+            return self._leader
+        # 續約：確認租約仍屬於自己才延長（WATCH 確保檢查與延長之間沒有被其他 replica 取得）
+        try:
+            with self._client.pipeline() as pipe:
+                pipe.watch(self._leader_key)
+                if pipe.get(self._leader_key) != self._id.encode():
+                    pipe.unwatch()
+                    self._leader = False
+                else:
+                    pipe.multi()
+                    pipe.pexpire(self._leader_key, self._lease_ms)
+                    pipe.execute()
+        except redis.WatchError:
+            self._leader = False
+        return self._leader
+
+    def publish(self, version: int, payload: bytes):
+        with self._client.pipeline() as pipe:
+            pipe.set(self._payload_key, payload)
+            pipe.set(self._version_key, version)
+            pipe.execute()
+
+    def read(self, known_version: int = -1):
+        version = self._client.get(self._version_key)
+        if version is None or int(version) <= known_version:
+            return None
+        return self._client.get(self._payload_key)
+
+    def touch(self, fetched_at: dict):
+        self._client.set(self._fetched_key, json.dumps(fetched_at))
+
+    def read_fetched_at(self):
+        raw = self._client.get(self._fetched_key)
+        if raw is None or raw == self._fetched_seen:
+            return None
+        self._fetched_seen = raw
+        return json.loads(raw)
+
+    def release(self):
+        if not self._leader:
+            return
+        self._leader = False
+        try:
+            with self._client.pipeline() as pipe:
+                pipe.watch(self._leader_key)
+                if pipe.get(self._leader_key) == self._id.encode():
+                    pipe.multi()
+                    pipe.delete(self._leader_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+        except Exception as e:
+            Log(f"釋放 leader 租約失敗：{e}", color=Color.YELLOW)
+
+
+def create_snapshot_store() -> SnapshotStore:
+    """依 SNAPSHOT_BACKEND 建立快照共用後端（memory / file / redis）"""
+    backend = Env.SNAPSHOT_BACKEND
+    if backend == "memory":
+        return MemorySnapshotStore()
+    if backend == "redis":
+        return RedisSnapshotStore(Env.REDIS_URL, prefix=Env.SNAPSHOT_KEY)
+    if backend != "file":
+        Log(f"未知的 SNAPSHOT_BACKEND：{backend}，使用 file", color=Color.YELLOW)
+    return FileSnapshotStore(Env.SNAPSHOT_PATH)
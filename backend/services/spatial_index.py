@@ -0,0 +1,118 @@
+import heapq
+import math
+from collections import defaultdict
+
+EARTH_RADIUS = 6371008.8    # 地球平均半徑（公尺）
+METERS_PER_DEGREE = 111320  # 緯度 1 度約略公尺數
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """計算兩點間的大圓距離（公尺）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class StationGridIndex:
+    """
+    站點空間索引（經緯度等距網格）
+
+    每份快照建立一次，將站點依座標放入固定大小的格子，
+    範圍查詢與最近站點查詢只需掃描相關格子。
+    沒有座標（0, 0）的站點不會被加入索引。
+
+    Args:
+        points (list): [(lat, lng), ...]，索引值即為查詢結果回傳的位置。
+        cell_size (float): 格子邊長（度），預設約 5.5 公里。
+    """
+
+    def __init__(self, points, cell_size: float = 0.05):
+        self.cell_size = cell_size
+        self._points = points
+        self._cells = defaultdict(list)     # {(row, col): [index, ...]}
+        for i, (lat, lng) in enumerate(points):
+            if lat or lng:
+                self._cells[self._cell(lat, lng)].append(i)
+        rows = [row for row, _ in self._cells] or [0]
+        cols = [col for _, col in self._cells] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return sum(len(indexes) for indexes in self._cells.values())
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> list:
+        """
+        查詢範圍內的站點
+        Returns:
+            list: 站點索引值
+        """
+        min_row, min_col = self._cell(min_lat, min_lng)
+        max_row, max_col = self._cell(max_lat, max_lng)
+        result = []
+        # 範圍很大時直接掃描已存在的格子，避免逐格走訪空格
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self._cells):
+            cells = [key for key in self._cells if min_row <= key[0] <= max_row and min_col <= key[1] <= max_col]
+        else:
+            cells = [(row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+        for key in cells:
+            for i in self._cells.get(key, ()):
+                lat, lng = self._points[i]
+                if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                    result.append(i)
+        return sorted(result)
+
+    def nearest(self, lat: float, lng: float, radius: float = None, k: int = None) -> list:
+        """
+        查詢最近的站點，由中心格子向外逐圈擴大搜尋。
+        Args:
+            lat, lng: 查詢中心
+            radius: 最大距離（公尺），None 表示不限
+            k: 最多回傳筆數，None 表示不限（需搭配 radius）
+        Returns:
+            list: [(距離公尺, 站點索引值), ...]，依距離排序
+        """
+        if not self._cells:
+            return []
+        center_row, center_col = self._cell(lat, lng)
+        # 每圈保證涵蓋的最短距離（取經度方向較短者，保守估計）
+        ring_meters = self.cell_size * METERS_PER_DEGREE * max(math.cos(math.radians(abs(lat) + self.cell_size)), 0.01)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_ring = max(center_row - min_row, max_row - center_row, center_col - min_col, max_col - center_col, 0)
+        if radius is not None:
+            max_ring = min(max_ring, int(radius / ring_meters) + 1)
+
+        # 需要走訪的格子比實際有資料的格子多很多時（例如查詢點離所有站點很遠），直接掃描全部
+        if (2 * max_ring + 1) ** 2 > 4 * len(self._cells):
+            found = []
+            for indexes in self._cells.values():
+                for i in indexes:
+                    distance = haversine(lat, lng, *self._points[i])
+                    if radius is None or distance <= radius:
+                        found.append((distance, i))
+            found.sort()
+            return found[:k] if k is not None else found
+
+        found = []
+        for ring in range(max_ring + 1):
+            for row in range(center_row - ring, center_row + ring + 1):
+                for col in range(center_col - ring, center_col + ring + 1):
+                    # 只走訪這一圈的外框
+                    if ring and center_row - ring < row < center_row + ring and center_col - ring < col < center_col + ring:
+                        continue
+                    for i in self._cells.get((row, col), ()):
+                        distance = haversine(lat, lng, *self._points[i])
+                        if radius is None or distance <= radius:
+                            found.append((distance, i))
+            # 已找到 k 筆，且尚未掃描的格子不可能更近時提前結束
+            if k is not None and len(found) >= k:
+                kth = heapq.nsmallest(k, found)[-1][0]
+                if kth <= ring * ring_meters:
+                    break
+
+        found.sort()
+        return found[:k] if k is not None else found
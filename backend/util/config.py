@@ -1,76 +1,207 @@
-from geopy.geocoders import Nominatim
-from firebase_admin import credentials, firestore
-import firebase_admin
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import json
+import os
+import queue
 import re
+import threading
+import time
 
 from util.logger import Log, Color
 from util.env import Env
+from util.firebase import Firebase
+from util.negative_cache import NegativeCache, NOT_FOUND, LOOKUP_ERROR
 
 class StationGPSManager:
     """
     站點 GPS 資料管理器（單例模式）
     
+    建立時只讀取本地座標檔（毫秒級），不連線 Firebase；
+    start() 才初始化 Firebase 並完成第一次同步，之後由背景執行緒定期增量同步。
+    
     功能：
-    1. reload(): 從 Firebase 擷取所有站點資料並快取。
-    2. get_or_create_gps(station_name): 取得或建立站點的 GPS 座標。
-    3. upload(station_name, lat, lng): 上傳站點的 GPS 座標。
-    4. get_station_GPS_dict(): 取得完整的 GPS 快取字典。
-    5. 支援 len() 與 in 運算子。
+    0. start(): 初始化 Firebase 並同步（於 lifespan 啟動時在執行緒中呼叫）；is_ready(): 座標資料是否已載入。
+    1. reload(): 從 Firebase 重新擷取所有站點資料並快取。
+       sync(): 只擷取上次同步後更新過的站點（依 updated_at）。
+    2. get_or_create_gps(station_name): 取得或建立站點的 GPS 座標（同步查詢）。
+    3. request_gps(station_name): 取得站點 GPS 座標，未知站點排入背景查詢（不阻塞）。
+    4. upload(station_name, lat, lng): 上傳站點的 GPS 座標。
+    5. get_station_GPS_dict(): 取得完整的 GPS 快取字典。
+    6. stats(): 取得地理編碼與失敗快取的統計。
+    7. 支援 len() 與 in 運算子。
     """
     from util.logger import Log, Color
     
     _instance = None
     _initialized = False
-    searchedStation = []    # 已搜尋過的站點列表
+    GEOCODE_INTERVAL = 1.0  # 地理編碼請求的最小間隔（秒），Nominatim 限制每秒 1 次
+    SYNC_INTERVAL = 600     # Firebase 增量同步間隔（秒）
+    SYNC_OVERLAP = timedelta(minutes=5)  # 沒有 updated_at 可參考時，同步起點往前保留的時間
+    STORE_VERSION = 1       # 本地座標檔格式版本
+    NOT_FOUND_TTL = 24 * 3600   # 查無座標的站點，隔多久再重新查詢（秒）
+    LOOKUP_ERROR_TTL = 300      # 查詢失敗（網路錯誤等）的站點，隔多久再重試（秒）
+    NEGATIVE_CACHE_SIZE = 1000  # 失敗快取最多保留的站點數
     
-    def __new__(cls, firebase_cred_path=Env.FIREBASE_SECRET):
+    def __new__(cls):
         """單例模式：確保只有一個實例"""
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
     
-    def __init__(self, firebase_cred_path=Env.FIREBASE_SECRET):
-        """初始化 GPS 管理器"""
+    def __init__(self):
+        """初始化 GPS 管理器（不連線 Firebase，見 start()）"""
         if not self._initialized:
             self._cache = {}
             self._db = None
-            self._geolocator = Nominatim(user_agent="geoapi")
+            self._geolocator = None     # 第一次查詢時才建立
+            self._geocode_queue = queue.Queue()
+            self._pending = set()       # 已排入背景查詢、尚未完成的站點
+            self._pending_lock = threading.Lock()
+            self._geocode_worker = None
+            self._geocode_lock = threading.Lock()   # 同一時間只送出一個地理編碼請求
+            self._last_geocode = 0.0    # 上次送出地理編碼請求的時間（monotonic）
+            self._failed = NegativeCache(self.NOT_FOUND_TTL, self.LOOKUP_ERROR_TTL, self.NEGATIVE_CACHE_SIZE)
+            self._geocode_stats = {"lookups": 0, "found": 0, NOT_FOUND: 0, LOOKUP_ERROR: 0}
+            self._store_path = Path(Env.GPS_STORE_PATH)
+            self._write_lock = threading.Lock()     # 保護快取寫入與本地檔案
+            self._synced_at = None      # 已同步到的 Firebase updated_at
+            self._sync_worker = None
+            self._ready = threading.Event()     # 座標資料已載入（本地檔案或第一次同步完成），供 /ready 使用
+            self._synced = threading.Event()    # start() 已完成（第一次同步完成或 Firebase 無法使用）
             
-            # 初始化 Firebase
+            # 先從本地檔案載入，不必等待 Firebase
+            self._load_store()
+            if self._cache:
+                self._ready.set()
+            StationGPSManager._initialized = True
+    
+    def start(self):
+        """
+        初始化 Firebase 並完成第一次同步，之後在背景定期增量同步（會阻塞，應在執行緒中呼叫）
+        Firebase 初始化失敗時沿用本地座標檔。
+        """
+        if self._sync_worker is not None:
+            return
+        try:
+            self._db = Firebase.get_db()
+        except Exception as e:
+            Log("Firebase 初始化失敗：", e, color=Color.RED)
+            Log("使用本地座標檔" if self._cache else "使用空白快取字典", color=Color.YELLOW)
+        else:
+            self.sync()
+            self._sync_worker = threading.Thread(target=self._sync_loop, name="gps-sync", daemon=True)
+            self._sync_worker.start()
+        finally:
+            self._ready.set()
+            self._synced.set()
+    
+    def is_ready(self):
+        """座標資料是否已載入（本地座標檔或 start() 完成）"""
+        return self._ready.is_set()
+    
+    def _get_geolocator(self):
+        """延遲載入 geopy，只有遇到未知站點時才需要"""
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent="geoapi")
+        return self._geolocator
+
+    def _load_store(self):
+        """讀取本地座標檔"""
+        try:
+            with open(self._store_path, encoding="utf-8") as f:
+                store = json.load(f)
+            if store.get("version") != self.STORE_VERSION:
+                Log("本地座標檔版本不符，略過", color=Color.YELLOW)
+                return
+            self._cache = store.get("stations", {})
+            if store.get("synced_at"):
+                self._synced_at = datetime.fromtimestamp(store["synced_at"], tz=timezone.utc)
+            Log(f"已從本地載入 {len(self._cache)} 個站點", color=Color.GREEN)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            Log(f"讀取本地座標檔失敗：{e}", color=Color.RED)
+    
+    def _save_store(self):
+        """將目前快取寫入本地座標檔（先寫暫存檔再替換，避免寫到一半）"""
+        with self._write_lock:
             try:
-                if not firebase_admin._apps:
-                    cred = credentials.Certificate(firebase_cred_path)
-                    firebase_admin.initialize_app(cred)
-                self._db = firestore.client()
-                
-                # 首次建立時從 Firebase 載入資料
-                self.reload()
-                StationGPSManager._initialized = True
+                self._store_path.parent.mkdir(parents=True, exist_ok=True)
+                store = {
+                    "version": self.STORE_VERSION,
+                    "synced_at": self._synced_at.timestamp() if self._synced_at else None,
+                    "stations": self._cache,
+                }
+                tmp_path = self._store_path.with_suffix(".tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(store, f, ensure_ascii=False)
+                os.replace(tmp_path, self._store_path)
             except Exception as e:
-                Log("Firebase 初始化失敗：", e, color=Color.RED)
-                Log("使用空白快取字典", color=Color.YELLOW)
+                Log(f"寫入本地座標檔失敗：{e}", color=Color.RED)
     
-    def reload(self):
-        """重新從 Firebase 擷取所有站點資料"""
+    def _set_gps(self, station_name, gps_data):
+        """寫入單一站點座標並更新本地檔案"""
+        with self._write_lock:
+            cache = dict(self._cache)
+            cache[station_name] = gps_data
+            self._cache = cache
+        self._save_store()
+    
+    def sync(self, full=False):
+        """
+        與 Firebase 同步站點資料
+        Args:
+            full: True 時重新擷取全部站點；否則只擷取上次同步後更新過的站點
+        """
         if self._db is None:
             Log("Firebase 未初始化", color=Color.RED)
             return
         
+        full = full or self._synced_at is None
+        started = datetime.now(timezone.utc)
         try:
-            Log("正在從 Firebase 載入站點資料...", color=Color.ORANGE)
-            self._cache.clear()
+            Log(f"正在從 Firebase {'載入' if full else '同步'}站點資料...", color=Color.ORANGE)
+            query = self._db.collection('stations')
+            if not full:
+                query = query.where(filter=Firebase.firestore().FieldFilter('updated_at', '>', self._synced_at))
             
-            docs = self._db.collection('stations').stream()
-            for doc in docs:
+            fetched = {}
+            latest = None
+            for doc in query.stream():
                 data = doc.to_dict()
                 # 使用原始站點名稱作為 key
                 station_name = data.get('name', doc.id)
-                self._cache[station_name] = data['data']
+                fetched[station_name] = data['data']
+                updated_at = data.get('updated_at')
+                if updated_at and (latest is None or updated_at > latest):
+                    latest = updated_at
             
-            Log(f"成功載入 {len(self._cache)} 個站點", color=Color.GREEN)
+            # 完成後一次替換，避免讀取端看到清空中的快取
+            with self._write_lock:
+                self._cache = fetched if full else {**self._cache, **fetched}
+                if latest is not None:
+                    self._synced_at = latest
+                elif full:
+                    # 舊資料沒有 updated_at 時，以本機時間（保留誤差）作為下次同步起點
+                    self._synced_at = started - self.SYNC_OVERLAP
+            if full or fetched:
+                self._save_store()
+            
+            Log(f"{'成功載入' if full else '同步更新'} {len(fetched)} 個站點，共 {len(self._cache)} 個", color=Color.GREEN)
         except Exception as e:
             Log(f"載入失敗：{e}", color=Color.RED)
     
+    def reload(self):
+        """重新從 Firebase 擷取所有站點資料"""
+        self.sync(full=True)
+    
+    def _sync_loop(self):
+        """背景同步執行緒：定期增量同步（第一次同步在 start() 中完成）"""
+        while True:
+            time.sleep(self.SYNC_INTERVAL)
+            self.sync()
+    
     def get_or_create_gps(self, station_name):
         """取得或建立站點的 GPS 座標
         Args:
@@ -82,20 +213,31 @@ class StationGPSManager:
         if station_name in self._cache:
             return self._cache[station_name]
         
+        # 最近查詢失敗過的站點，到期前不重複查詢
+        if station_name in self._failed:
+            return None
+        
         # 使用 Nominatim 查詢
         try:
-            if station_name in self.searchedStation: return None    # 避免重複查詢
             Log(f"正在查詢 {station_name} 的 GPS 座標...", color=Color.ORANGE)
-            location = self._geolocator.geocode(station_name + ", Taiwan")
+            with self._geocode_lock:
+                # 限制查詢頻率：只在實際送出請求前等待，快取命中的站點不受影響
+                time.sleep(max(0, self._last_geocode + self.GEOCODE_INTERVAL - time.monotonic()))
+                self._geocode_stats["lookups"] += 1
+                try:
+                    location = self._get_geolocator().geocode(station_name + ", Taiwan")
+                finally:
+                    self._last_geocode = time.monotonic()
             
             if location:
+                self._geocode_stats["found"] += 1
                 gps_data = {
                     'lat': location.latitude,
                     'lng': location.longitude
                 }
                 
-                # 存入快取
-                self._cache[station_name] = gps_data
+                # 存入快取與本地檔案
+                self._set_gps(station_name, gps_data)
                 # 回存 Firebase
                 if self._db:
                     try:
@@ -103,7 +245,8 @@ class StationGPSManager:
                         doc_ref = self._db.collection('stations').document(clean_name)
                         doc_ref.set({
                             'name': station_name,
-                            'data': gps_data
+                            'data': gps_data,
+                            'updated_at': Firebase.firestore().SERVER_TIMESTAMP
                         })
                         Log(f"已存入 Firebase：「{station_name} - {gps_data}」", color=Color.GREEN)
                     except Exception as e:
@@ -111,12 +254,55 @@ class StationGPSManager:
                 return gps_data
             else:
                 Log(f"找不到 {station_name} 的 GPS 座標", color=Color.YELLOW)
+                kind = NOT_FOUND
         except Exception as e:
             Log(f"查詢失敗：{e}", color=Color.RED)
+            kind = LOOKUP_ERROR
         
-        self.searchedStation.append(station_name)   # 記錄已搜尋過的站點
+        self._geocode_stats[kind] += 1
+        self._failed.add(station_name, kind)    # 記錄失敗的站點，到期後才重新查詢
         return None
 
+    def request_gps(self, station_name):
+        """取得站點的 GPS 座標（不阻塞）
+        
+        快取中沒有的站點會排入背景查詢（去除重複、限制頻率），
+        查到後寫入快取，下一份快照即會帶有座標。
+        Args:
+            station_name: 站點名稱
+        Returns:
+            dict: {'lat': float, 'lng': float} 或 None（尚未取得）
+        """
+        gps = self._cache.get(station_name)
+        if gps is not None or station_name in self._failed:
+            return gps
+        
+        with self._pending_lock:
+            if station_name in self._pending:
+                return None
+            self._pending.add(station_name)
+            if self._geocode_worker is None or not self._geocode_worker.is_alive():
+                self._geocode_worker = threading.Thread(target=self._geocode_loop, name="geocode-worker", daemon=True)
+                self._geocode_worker.start()
+        self._geocode_queue.put(station_name)
+        return None
+    
+    def is_pending(self, station_name):
+        """站點是否正在等待背景查詢"""
+        return station_name in self._pending
+    
+    def _geocode_loop(self):
+        """背景查詢執行緒：依序查詢排隊中的站點"""
+        # 等第一次同步完成（本地座標檔可能過舊），Firebase 已有座標的站點不必再查詢，也不會覆寫 Firebase 上的座標
+        self._synced.wait()
+        while True:
+            station_name = self._geocode_queue.get()
+            try:
+                self.get_or_create_gps(station_name)     # 查詢頻率限制在 get_or_create_gps 中
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(station_name)
+    
     def upload(self, station_name, lat, lng):
         """
         上傳站點的 GPS 座標
@@ -134,16 +320,17 @@ class StationGPSManager:
                     gps_data = {'lat': lat, 'lng': lng}
                     doc_ref.set({
                         'name': station_name,
-                        'data': gps_data
+                        'data': gps_data,
+                        'updated_at': Firebase.firestore().SERVER_TIMESTAMP
                     }, merge=True)
-                    self._cache[station_name] = gps_data
+                    self._set_gps(station_name, gps_data)
                     Log(f"已存入 Firebase：「{station_name} - {gps_data}」", color=Color.GREEN)
                 except Exception as e:
                     Log(f"存入 Firebase 失敗：{e}", color=Color.RED)
         except Exception as e:
             Log(f"新增失敗：{e}", color=Color.RED)
         
-        self.searchedStation.append(station_name)   # 記錄已搜尋過的站點
+        self._failed.discard(station_name)  # 已有座標，不再視為查詢失敗
     
     def get_station_GPS_dict(self):
         """
@@ -153,6 +340,19 @@ class StationGPSManager:
         """
         return self._cache.copy()
     
+    def stats(self):
+        """
+        取得地理編碼統計
+        Returns:
+            dict: geocode（實際查詢次數與結果）、negative_cache（失敗快取命中與大小）、pending（排隊中站點數）
+        """
+        return {
+            "stations": len(self._cache),
+            "pending": len(self._pending),
+            "geocode": dict(self._geocode_stats),
+            "negative_cache": self._failed.stats(),
+        }
+    
     def __len__(self):
         """回傳快取中的站點數量"""
         return len(self._cache)
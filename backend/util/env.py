@@ -12,5 +12,15 @@ class Env:
     RELOAD: bool = os.getenv("RELOAD", "").lower() == "true"
     PORT: int = int(os.getenv("PORT", 7860))    # Hugging Face Spaces 預設使用 7860 port
     FIREBASE_SECRET: dict = json.loads(os.getenv("FIREBASE_SECRET", "{}"))
+    GPS_STORE_PATH: str = os.getenv("GPS_STORE_PATH", "data/station_gps.json")    # 站點座標本地快取檔
+    SNAPSHOT_BACKEND: str = os.getenv("SNAPSHOT_BACKEND", "file").lower()   # 快照共用方式：memory、file、redis
+    SNAPSHOT_PATH: str = os.getenv("SNAPSHOT_PATH", "data/locker_snapshot.bin")   # 最後一份快照（重新啟動時先載入；file 後端同時用於 worker 間共用）
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")     # redis：多個 replica 共用的 Redis
+    SNAPSHOT_KEY: str = os.getenv("SNAPSHOT_KEY", "lockermaps")             # redis：key 前綴
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "").upper()     # 未設定時：RELOAD 為 DEBUG，否則 INFO
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text" if RELOAD else "json").lower()    # json 或 text
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", 1.0))   # 成功請求日誌的取樣比例
+    FEEDBACK_QUEUE_PATH: str = os.getenv("FEEDBACK_QUEUE_PATH", "data/feedback_queue.db")  # 意見回饋寫入佇列
+    API_USAGE_PATH: str = os.getenv("API_USAGE_PATH", "data/api_usage.db")     # 尚未上傳的 API 使用量
     
 env = Env()
\ No newline at end of file
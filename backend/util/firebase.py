@@ -0,0 +1,45 @@
+import threading
+
+from util.env import Env
+
+
+class Firebase:
+    """
+    Firebase / Firestore 連線（延遲初始化）
+
+    匯入時不做任何事，第一次呼叫 get_db() 時才初始化 firebase_admin 並建立 Firestore client，
+    之後重複使用同一個 client。可在多個執行緒中呼叫。
+    """
+
+    _db = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_db(cls):
+        """
+        取得 Firestore client（第一次呼叫時初始化 Firebase）
+        Returns:
+            google.cloud.firestore.Client
+        Raises:
+            Exception: 金鑰無效或初始化失敗
+        """
+        if cls._db is not None:
+            return cls._db
+        with cls._lock:
+            if cls._db is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app(credentials.Certificate(Env.FIREBASE_SECRET))
+                cls._db = firestore.client()
+        return cls._db
+
+    @staticmethod
+    def firestore():
+        """
+        取得 firebase_admin.firestore 模組（Increment、SERVER_TIMESTAMP、transactional、FieldFilter...）
+        第一次呼叫時才載入 Firestore 套件，匯入本專案的模組時不會載入。
+        """
+        from firebase_admin import firestore
+        return firestore
@@ -0,0 +1,81 @@
+import asyncio
+import httpx
+
+from util.logger import Log, Color
+from util.metrics import UPSTREAM_ERRORS
+
+# HTTP/2 需要額外安裝 h2，沒有時退回 HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HttpClient:
+    """
+    共用的非同步 HTTP 用戶端（長連線池）
+
+    所有爬蟲共用同一個 httpx.AsyncClient，重複使用 TCP/TLS 連線，
+    並提供逾時與指數退避重試。
+    """
+
+    DEFAULT_TIMEOUT = 10    # 單次請求逾時（秒）
+    RETRIES = 2             # 失敗後重試次數
+    BACKOFF = 0.5           # 第一次重試前等待秒數，之後倍增
+
+    _client = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        """取得（必要時建立）共用的 AsyncClient"""
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=cls.DEFAULT_TIMEOUT,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+                follow_redirects=True,
+            )
+        return cls._client
+
+    @classmethod
+    async def request(cls, method: str, url: str, retries: int = RETRIES, **kwargs) -> httpx.Response:
+        """
+        發送請求，遇到連線錯誤或 5xx 時以指數退避重試。
+        Args:
+            method: HTTP 方法
+            url: 目標網址
+            retries: 重試次數
+            **kwargs: 傳給 httpx 的其他參數（json、headers、timeout...）
+        Returns:
+            httpx.Response: 狀態碼為 2xx 的回應，或條件式請求的 304
+        """
+        client = cls.get_client()
+        for attempt in range(retries + 1):
+            try:
+                response = await client.request(method, url, **kwargs)
+                if response.status_code == 304:    # If-None-Match / If-Modified-Since：內容未變動
+                    return response
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                UPSTREAM_ERRORS.labels(e.request.url.host, f"{e.response.status_code // 100}xx").inc()
+                if e.response.status_code < 500 or attempt == retries:
+                    raise
+                error = e
+            except httpx.TransportError as e:
+                kind = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+                UPSTREAM_ERRORS.labels(httpx.URL(url).host, kind).inc()
+                if attempt == retries:
+                    raise
+                error = e
+            delay = cls.BACKOFF * (2 ** attempt)
+            Log(f"請求 {url} 失敗: {error!r}，{delay} 秒後重試", color=Color.YELLOW)
+            await asyncio.sleep(delay)
+
+    @classmethod
+    async def close(cls):
+        """關閉連線池"""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
@@ -1,6 +1,15 @@
 from functools import wraps
-import inspect
+from datetime import datetime
 from enum import Enum
+import atexit
+import inspect
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
 
 from util.env import Env
 from util.nowtime import TaiwanTime
@@ -25,58 +34,190 @@ ICON_BY_COLOR = {
     Color.ORANGE: "🟠",
 }
 
+# 顏色對應日誌等級
+LEVEL_BY_COLOR = {
+    Color.RED: logging.ERROR,
+    Color.YELLOW: logging.WARNING,
+}
+
+# === 日誌輸出 ===
+# 呼叫端只建立 LogRecord 放入佇列，字串組合、時間格式化與輸出都在背景執行緒進行。
+# LOG_FORMAT=json 時每筆輸出一行 JSON；text 為開發用的彩色格式。
+
+class _StdoutHandler(logging.StreamHandler):
+    """每次輸出時才取得 sys.stdout，支援 contextlib.redirect_stdout"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _Record(logging.LogRecord):
+    """精簡的 LogRecord：只記錄輸出需要的欄位，建立成本比標準 LogRecord 低"""
+
+    def __init__(self, level: int, fields: dict):
+        self.__dict__.update(fields)
+        self.name = logger.name
+        self.levelno = level
+        self.levelname = logging.getLevelName(level)
+        self.created = time.time()
+        self.msg = ""
+        self.args = None
+        self.exc_info = None
+        self.exc_text = None
+
+
+def _message(record) -> str:
+    """組合 Log() 的訊息內容"""
+    args = getattr(record, "log_args", None)
+    if args is None:
+        return record.getMessage()
+    return record.log_sep.join(str(arg) for arg in args)
+
+
+def _call_string(record) -> str:
+    """組合 log_print 記錄的參數字串"""
+    parts = []
+    if record.call_args:
+        parts.append(", ".join(map(str, record.call_args)))
+    if record.call_kwargs:
+        parts.append(", ".join(f"{k}={v}" for k, v in record.call_kwargs.items()))
+    return ", ".join(parts)
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌輸出一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, TaiwanTime.TIMEZONE).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+        }
+        if hasattr(record, "func"):
+            entry.update(
+                func=record.func,
+                args=_call_string(record),
+                duration_ms=record.duration_ms,
+                outcome=record.outcome,
+            )
+            if record.status is not None:
+                entry["status"] = record.status
+            if record.error is not None:
+                entry["error"] = record.error
+        else:
+            entry["msg"] = _message(record)
+        return json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+
+class TextFormatter(logging.Formatter):
+    """與原本 print 相同的彩色文字格式"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created, TaiwanTime.TIMEZONE)
+        prefix = timestamp.strftime("%Y-%m-%d %H:%M:%S") + f":{timestamp.microsecond // 1000:03d} | "
+        if hasattr(record, "func"):
+            if record.outcome == "error":
+                color, text = Color.RED, f"🔴 [Error] {record.func}: {record.error or record.status} ({record.duration_ms} ms)"
+            else:
+                color, label = (Color.PURPLE, "🟣 [FunctionCall]") if record.is_async else (Color.BLUE, "🔵 [Function]")
+                text = f"{label} {record.func}({_call_string(record)}) {record.duration_ms} ms"
+            return f"{prefix}{color.value}{text}{Color.RESET.value}\n"
+        color = getattr(record, "color", Color.BLUE)
+        icon = ICON_BY_COLOR.get(color, "")
+        end = getattr(record, "log_end", "\n")
+        return f"{prefix}{icon} {color.value}{_message(record)}{Color.RESET.value}{end}"
+
+
+def _emit(level: int, fields: dict):
+    """建立 LogRecord 並直接放入佇列，由背景執行緒格式化與輸出"""
+    _queue.put_nowait(_Record(level, fields))
+
+
+logger = logging.getLogger("lockermaps")
+logger.setLevel(Env.LOG_LEVEL or ("DEBUG" if Env.RELOAD else "INFO"))
+logger.propagate = False
+
+_handler = _StdoutHandler()
+_handler.setFormatter(JsonFormatter() if Env.LOG_FORMAT == "json" else TextFormatter())
+_handler.terminator = ""
+_queue = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_queue, _handler, respect_handler_level=False)
+logger.addHandler(logging.handlers.QueueHandler(_queue))
+_listener.start()
+atexit.register(_listener.stop)
+
 # === 日誌裝飾器 ===
 def log_print(func):
-    def build_arg_string(args, kwargs):
-        parts = []
-        if args:
-            parts.append(", ".join(map(str, args)))
-        if kwargs:
-            parts.append(", ".join(f"{k}={v}" for k, v in kwargs.items()))
-        return ", ".join(parts)
-
-    if inspect.iscoroutinefunction(func):
+    """
+    記錄函式呼叫：參數、耗時、結果（ok / error）與回應狀態碼。
+    成功的呼叫依 LOG_SAMPLE_RATE 取樣，失敗（例外或 5xx）一律記錄。
+    """
+    func_name = func.__name__
+    is_async = inspect.iscoroutinefunction(func)
+
+    def record(args, kwargs, started, result=None, error=None):
+        status = getattr(result, "status_code", None)
+        status = status if isinstance(status, int) else None
+        failed = error is not None or (status is not None and status >= 500)
+        if failed:
+            level = logging.ERROR
+        elif Env.LOG_SAMPLE_RATE < 1 and random.random() >= Env.LOG_SAMPLE_RATE:
+            return
+        else:
+            level = logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        _emit(level, {
+            "func": func_name,
+            "is_async": is_async,
+            "call_args": args,
+            "call_kwargs": kwargs,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "outcome": "error" if failed else "ok",
+            "status": status,
+            "error": str(error) if error is not None else getattr(result, "detail", None) if failed else None,
+        })
+
+    if is_async:
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            func_name = func.__name__
-            arg_str = build_arg_string(args, kwargs)
+            started = time.perf_counter()
             try:
-                print(f"{TaiwanTime.string(ms=True)} | "
-                      f"{Color.PURPLE.value}🟣 [FunctionCall] {func_name}({arg_str}){Color.RESET.value}")
-
-                return await func(*args, **kwargs)
+                result = await func(*args, **kwargs)
             except Exception as e:
-                print(f"{TaiwanTime.string(ms=True)} | "
-                      f"{Color.RED.value}🔴 [Error] {func_name}: {e}{Color.RESET.value}")
+                record(args, kwargs, started, error=e)
                 raise
+            record(args, kwargs, started, result=result)
+            return result
         return async_wrapper
     else:
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            func_name = func.__name__
-            arg_str = build_arg_string(args, kwargs)
+            started = time.perf_counter()
             try:
-                print(f"{TaiwanTime.string(ms=True)} | "
-                      f"{Color.BLUE.value}🔵 [Function] {func_name}({arg_str}){Color.RESET.value}")
-                return func(*args, **kwargs)
+                result = func(*args, **kwargs)
             except Exception as e:
-                print(f"{TaiwanTime.string(ms=True)} | "
-                      f"{Color.RED.value}🔴 [Error] {func_name}: {e}{Color.RESET.value}")
+                record(args, kwargs, started, error=e)
                 raise
+            record(args, kwargs, started, result=result)
+            return result
         return sync_wrapper
 
 def Log(*args, color: Color = Color.BLUE, sep=" ", end="\n", reload_only: bool = False):
     """
-    印出帶有時間戳記與顏色的日誌訊息。
+    記錄帶有時間戳記與顏色的日誌訊息（由背景執行緒輸出）。
     Args:
-        *args: 要印出的訊息內容。
-        color (Color): 訊息顏色，預設為藍色。
+        *args: 要記錄的訊息內容。
+        color (Color): 訊息顏色，預設為藍色；紅色為 ERROR、黃色為 WARNING，其餘為 INFO。
         sep (str): 訊息間的分隔符號，預設為空格。
         end (str): 訊息結尾的字元，預設為換行符號。
-        reload_only (bool): 是否僅在 Env.RELOAD=True 時印出訊息，預設為 False。
+        reload_only (bool): 是否為開發用訊息（DEBUG 等級，預設只在 Env.RELOAD=True 時輸出），預設為 False。
     """
-    if reload_only and not Env.RELOAD:
+    level = logging.DEBUG if reload_only else LEVEL_BY_COLOR.get(color, logging.INFO)
+    if not logger.isEnabledFor(level):
         return
-    icon = ICON_BY_COLOR.get(color, "")
-    message = sep.join(str(arg) for arg in args)
-    print(f"{TaiwanTime.string(ms=True)} | {icon} {color.value}{message}{Color.RESET.value}", end=end)
\ No newline at end of file
+    _emit(level, {"log_args": args, "log_sep": sep, "color": color, "log_end": end})
@@ -0,0 +1,115 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# === 指標定義 ===
+# 標籤值只使用固定集合（路由樣板、來源名稱、主機名稱），避免時間序列數量失控
+
+REQUEST_LATENCY = Histogram(
+    "lockermaps_http_request_duration_seconds",
+    "從收到請求到送出回應標頭的時間",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSE_BYTES = Histogram(
+    "lockermaps_http_response_bytes",
+    "回應內容大小（壓縮後）",
+    ["route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 131072, 262144, 524288, 1048576, 4194304),
+)
+SOURCE_DURATION = Histogram(
+    "lockermaps_source_duration_seconds",
+    "各來源爬取（fetch）與解析（parse）耗時",
+    ["source", "stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20),
+)
+SOURCE_PAYLOAD_BYTES = Histogram(
+    "lockermaps_source_payload_bytes",
+    "上游回應內容大小（解壓縮後）",
+    ["source"],
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+SOURCE_UNCHANGED = Counter(
+    "lockermaps_source_unchanged_total",
+    "上游內容沒有變動、沿用上次解析結果的次數（not_modified：304、identical：內容相同）",
+    ["source", "reason"],
+)
+SOURCE_REFRESHES = Counter(
+    "lockermaps_source_refreshes_total",
+    "各來源更新次數（ok：成功、stale：失敗但沿用上次資料、error：失敗且沒有資料）",
+    ["source", "outcome"],
+)
+SOURCE_LAST_SUCCESS = Gauge(
+    "lockermaps_source_last_success_timestamp_seconds",
+    "各來源最後一次更新成功的時間",
+    ["source"],
+)
+UPSTREAM_ERRORS = Counter(
+    "lockermaps_upstream_errors_total",
+    "上游請求錯誤次數（含重試）",
+    ["host", "kind"],
+)
+SNAPSHOT_VERSION = Gauge("lockermaps_snapshot_version", "目前快照版本")
+SNAPSHOT_PUBLISHES = Counter("lockermaps_snapshot_publishes_total", "快照發布次數")
+LOCKER_REQUESTS = Counter(
+    "lockermaps_locker_requests_total",
+    "/Locker 請求的快取結果（not_modified：304、prerendered：預先序列化的內容、computed：依篩選條件即時計算）",
+    ["result"],
+)
+
+
+@contextmanager
+def time_stage(source: str, stage: str):
+    """記錄來源爬取或解析耗時"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SOURCE_DURATION.labels(source, stage).observe(time.perf_counter() - started)
+
+
+def render() -> tuple:
+    """
+    輸出 Prometheus 文字格式
+    Returns:
+        tuple: (內容 bytes, Content-Type)
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    記錄每個請求的延遲與回應大小（ASGI middleware）
+
+    延遲計算到送出回應標頭為止，推播等長連線不會拉高延遲分布；
+    路由以樣板（例如 /Locker/changes）作為標籤，找不到路由時為 unmatched。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["latency"] = time.perf_counter() - started
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            latency = state.get("latency", time.perf_counter() - started)
+            REQUEST_LATENCY.labels(scope["method"], route, str(state["status"])).observe(latency)
+            RESPONSE_BYTES.labels(route).observe(state["bytes"])
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+NOT_FOUND = "not_found"     # 查無結果
+LOOKUP_ERROR = "error"      # 查詢失敗（網路錯誤、限流等）
+
+
+class NegativeCache:
+    """
+    查詢失敗結果的快取（有到期時間與數量上限）
+
+    「查無結果」與「查詢失敗」分開設定到期時間：前者通常不會很快改變，
+    後者多為暫時性問題，應該較快重試。超過數量上限時淘汰最早加入的項目。
+
+    Args:
+        not_found_ttl (float): 查無結果的保留秒數。
+        error_ttl (float): 查詢失敗的保留秒數。
+        max_size (int): 最多保留的項目數。
+    """
+
+    def __init__(self, not_found_ttl: float, error_ttl: float, max_size: int):
+        self.ttl = {NOT_FOUND: not_found_ttl, LOOKUP_ERROR: error_ttl}
+        self.max_size = max_size
+        self._entries = OrderedDict()   # {key: (種類, 到期時間)}，依加入順序排列
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """是否仍在快取中（未到期），並計入命中統計"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            self._stats["hits" if entry else "misses"] += 1
+            return entry is not None
+
+    def add(self, key, kind: str = NOT_FOUND):
+        """
+        記錄一次失敗的查詢
+        Args:
+            key: 查詢鍵值
+            kind: NOT_FOUND 或 LOOKUP_ERROR
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (kind, time.monotonic() + self.ttl[kind])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def discard(self, key):
+        """移除項目（例如已手動補上資料）"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """命中統計與目前各種類的項目數"""
+        with self._lock:
+            now = time.monotonic()
+            kinds = {NOT_FOUND: 0, LOOKUP_ERROR: 0}
+            for kind, expires in self._entries.values():
+                if expires > now:
+                    kinds[kind] += 1
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "entries": kinds,
+            }
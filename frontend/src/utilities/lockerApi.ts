@@ -40,6 +40,8 @@ export interface StationData {
     lat?: number;
     /** 經度 */
     lng?: number;
+    /** 座標查詢中（尚未取得時 lat/lng 為 0） */
+    gps_pending?: boolean;
 }
 
 /**